@@ -0,0 +1,602 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of Font Maker. The suite runs offline: it uses a TrueType font
+found on the system (or assigned with -f), and generates a BDF font from it
+to go through gen_pil_if_necessary. Results are saved as JSON files to be
+compared with each other, and golden-image checks show that faster paths
+(e.g., the numpy engine, parallel jobs, and the all command) give the same
+pictures as the plain one.
+
+Examples
+--------
+python bench.py run -o base.json
+python bench.py run -s ascii,3k -o new.json
+python bench.py compare base.json new.json
+python bench.py golden -o golden.json
+python bench.py golden -c golden.json
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import sys
+import imp
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import platform
+import argparse
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'fontmaker'))
+
+import PIL
+from PIL import Image, ImageFont, ImageDraw
+
+import fontmaker
+import decor
+import cache
+import fontcover
+
+
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+    '/usr/share/fonts/liberation/LiberationSans-Regular.ttf',
+    '/Library/Fonts/Arial.ttf',
+    'C:/Windows/Fonts/arial.ttf',
+]
+
+# fonts covering CJK ideographs for the CJK char sets
+CJK_FONT_CANDIDATES = [
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/wenquanyi/wqy-microhei/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf',
+    '/System/Library/Fonts/PingFang.ttc',
+    'C:/Windows/Fonts/msyh.ttc',
+    'C:/Windows/Fonts/simsun.ttc',
+]
+
+# char sets: name -> (first codepoint, count)
+CHAR_SETS = {
+    'ascii': (0x20, 95),
+    '3k': (0x4E00, 3000),
+    '20k': (0x4E00, 20000),
+}
+
+DEFAULT_SETS = 'ascii,3k,20k'
+
+FONT_HEIGHT = 24
+
+#------------------------------------------------------------------------------
+# Fixtures
+#------------------------------------------------------------------------------
+
+def find_font(candidates=FONT_CANDIDATES, required=True):
+    """Return the first TrueType font found in *candidates*. If none is
+    found, raise ValueError if *required*, or else return None.
+    """
+    for fn in candidates:
+        if os.path.isfile(fn):
+            return fn
+    if not required:
+        return None
+    raise ValueError('No TrueType font found; assign one with -f.')
+
+
+def has_numpy():
+    """Check if NumPy is installed for the numpy engine.
+    """
+    try:
+        imp.find_module('numpy')
+    except ImportError:
+        return False
+    return True
+
+
+def covers(font, first, count):
+    """Check if a font covers every codepoint of a char set.
+    """
+    last = first + count - 1
+    return any(a <= first and last <= b
+               for a, b in fontcover.font_ranges(font))
+
+
+def make_bdf(fn, ttf, size=16):
+    """Make a BDF font of ASCII characters drawn with a TrueType font.
+    """
+    font = ImageFont.truetype(ttf, size)
+    ascent, descent = font.getmetrics()
+    h = ascent + descent
+    chars = []
+    for code in range(0x20, 0x7F):
+        w = font.getsize(chr(code))[0]
+        im = Image.new('1', (w, h))
+        ImageDraw.Draw(im).text((0, 0), chr(code), font=font, fill=1)
+        data = im.tobytes() if w else b''
+        row = (w + 7) // 8
+        chars.append((code, w, [data[i:i+row].encode('hex').upper()
+                                for i in range(0, len(data), row)]))
+
+    lines = [
+        'STARTFONT 2.1',
+        'FONT -bench-sans-medium-r-normal--{0}-{1}-75-75-p-0-iso8859-1'.format(
+            size, size * 10),
+        'SIZE {} 75 75'.format(size),
+        'FONTBOUNDINGBOX {} {} 0 {}'.format(max(x[1] for x in chars), h,
+                                            -descent),
+        'STARTPROPERTIES 2',
+        'FONT_ASCENT {}'.format(ascent),
+        'FONT_DESCENT {}'.format(descent),
+        'ENDPROPERTIES',
+        'CHARS {}'.format(len(chars)),
+    ]
+    for code, w, rows in chars:
+        lines += [
+            'STARTCHAR U+{:04X}'.format(code),
+            'ENCODING {}'.format(code),
+            'SWIDTH {} 0'.format(w * 1000 // size),
+            'DWIDTH {} 0'.format(w),
+            'BBX {} {} 0 {}'.format(w, h, -descent),
+            'BITMAP',
+        ] + (rows if w else []) + ['ENDCHAR']
+    lines.append('ENDFONT')
+    with open(fn, 'wb') as f:
+        f.write('\n'.join(lines) + '\n')
+    return fn
+
+
+def write_lists(dir_name, name, ranges):
+    """Write a char list file of (first codepoint, count) ranges and a
+    filename list file of ASCII names; return their filenames.
+    """
+    chars_fn = os.path.join(dir_name, name + '.lst')
+    names_fn = os.path.join(dir_name, name + '.names')
+    with open(chars_fn, 'wb') as f:
+        for first, count in ranges:
+            f.write('U+{:04X}..U+{:04X}\n'.format(first, first + count - 1))
+    with open(names_fn, 'wb') as f:
+        f.write('\n'.join('U{:04X}.png'.format(x) for first, count in ranges
+                          for x in range(first, first + count)))
+    return chars_fn, names_fn
+
+
+class Fixture(object):
+    """The fonts, char lists, and a scratch directory of a run.
+    """
+    def __init__(self, ttf=None, cjk=None):
+        self.dir_name = tempfile.mkdtemp(prefix='fmbench')
+        os.environ[cache.CACHE_ENV] = os.path.join(self.dir_name, 'cache')
+        self.ttf = ttf or find_font()
+        self.cjk = cjk or find_font(CJK_FONT_CANDIDATES, required=False)
+        self.bdf = make_bdf(os.path.join(self.dir_name, 'bench.bdf'),
+                            self.ttf)
+        self.lists = {}
+
+    def char_list(self, name):
+        """Return (chars filename, names filename) of a char set.
+        """
+        if name not in self.lists:
+            self.lists[name] = write_lists(self.dir_name, name,
+                                           [CHAR_SETS[name]])
+        return self.lists[name]
+
+    def font_of(self, name):
+        """Return the font covering a char set, or None if no font does;
+        the missing-glyph boxes of an uncovered set time nothing of its
+        script.
+        """
+        for font in [self.ttf, self.cjk]:
+            if font and covers(font, *CHAR_SETS[name]):
+                return font
+        return None
+
+    def out_dir(self, *names):
+        path = os.path.join(self.dir_name, 'out', *names)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        return path
+
+    def close(self):
+        shutil.rmtree(self.dir_name, ignore_errors=True)
+
+#------------------------------------------------------------------------------
+# Benchmarks
+#------------------------------------------------------------------------------
+
+def measure(func, repeat, setup=None):
+    """Return the best seconds of *repeat* calls of func(); setup() is called
+    before each call without being timed.
+    """
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = timer()
+        func()
+        seconds = timer() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def bench_micro(fx, repeat):
+    """Yield (name, count, seconds) of each stage on ASCII characters.
+    """
+    ascii_chars = [unichr(x) for x in range(0x20, 0x7F)]
+    fg_level, ol_level, bg_level = 0, 128, 255
+    colors = [(255, 0, 0), (0, 128, 0), (0, 0, 0)]
+
+    def cold():
+        fontmaker._size_tables.clear()
+        shutil.rmtree(os.environ[cache.CACHE_ENV], ignore_errors=True)
+
+    yield ('select_font.cold', 1, measure(
+        lambda: fontmaker.select_font(fx.ttf, FONT_HEIGHT), repeat, cold))
+    yield ('select_font.warm', 1, measure(
+        lambda: fontmaker.select_font(fx.ttf, FONT_HEIGHT), repeat,
+        fontmaker._size_tables.clear))
+    yield ('select_font.bdf', 1, measure(
+        lambda: fontmaker.select_font(fx.bdf, FONT_HEIGHT), repeat))
+
+    _h, font = fontmaker.select_font(fx.ttf, FONT_HEIGHT)
+    n = len(ascii_chars)
+    pics = {}
+
+    def gen_ch_pics():
+        pics['base'] = [fontmaker._gen_ch_pic(ch, font, fg_level, bg_level,
+                                              False) for ch in ascii_chars]
+
+    def gen_fore_pics():
+        pics['fore'] = [fontmaker._gen_fore_pic(ch, font, colors[0], False)
+                        for ch in ascii_chars]
+
+    def add_decor(func):
+        pics['decor'] = [func(im, fg_level, ol_level, bg_level)
+                         for im in pics['base']]
+
+    def apply_colors():
+        pics['color'] = [fontmaker._apply_color(im, *colors)
+                         for im in pics['decor']]
+
+    def save_pics(dir_name):
+        for i, im in enumerate(pics['color']):
+            fontmaker._save_pic(im, os.path.join(dir_name, '%d.png' % i))
+
+    def gen_ch_pics_batch():
+        fontmaker._gen_ch_pics(ascii_chars, font, fg_level, bg_level, False)
+
+    def gen_fore_pics_batch():
+        fontmaker._gen_fore_pics(ascii_chars, font, colors[0], False)
+
+    yield ('gen_ch_pic', n, measure(gen_ch_pics, repeat))
+    yield ('gen_ch_pics.batch', n, measure(gen_ch_pics_batch, repeat))
+    yield ('gen_fore_pic', n, measure(gen_fore_pics, repeat))
+    yield ('gen_fore_pics.batch', n, measure(gen_fore_pics_batch, repeat))
+    for name in ['add_outline', 'add_shadow11', 'add_shadow21']:
+        func = getattr(decor, name)
+        yield ('decor.' + name, n, measure(lambda: add_decor(func), repeat))
+
+    try:
+        import npdecor
+    except ImportError:
+        npdecor = None
+    if npdecor:
+        for name in ['add_outline', 'add_shadow11', 'add_shadow21']:
+            func = getattr(npdecor, name)
+            yield ('npdecor.' + name, n, measure(lambda: npdecor.decorate(
+                pics['base'], func, fg_level, ol_level, bg_level), repeat))
+
+    yield ('apply_color', n, measure(apply_colors, repeat))
+    dir_name = fx.out_dir('micro')
+    yield ('save_png', n, measure(lambda: save_pics(dir_name), repeat))
+
+
+def command_variants():
+    """Return (name, arguments) of end-to-end commands.
+    """
+    colors = ['-cRed', '-lGreen']
+    variants = [('fore', ['fore', '-cRed'])]
+    variants += [(x, [x] + colors)
+                 for x in ['outline', 'shadow11', 'shadow21']]
+    variants += [
+        ('all', ['all'] + colors),
+        ('all.jobs', ['all', '-j', '0'] + colors),
+    ]
+    if has_numpy():
+        variants.append(('all.numpy', ['all', '-E', 'numpy'] + colors))
+    return variants
+
+
+def run_command(fx, argv, chars_fn, names_fn, font, dir_name):
+    """Run a command of fontmaker in this process; the all command writes
+    every effect into a sub directory of *dir_name*.
+    """
+    argv = list(argv) + ['-n', names_fn, '-f', font, '-s', str(FONT_HEIGHT)]
+    if argv[0] == 'all':
+        for x in fontmaker.EFFECTS:
+            argv += ['-e', '{}={}'.format(x, os.path.join(dir_name, x))]
+    else:
+        argv += ['-d', dir_name]
+    fontmaker.parse_args(argv + [chars_fn])
+
+
+def bench_commands(fx, sets, repeat):
+    """Yield (name, count, seconds) of end-to-end commands at char sets;
+    a char set no font covers is skipped.
+    """
+    for set_name in sets:
+        font = fx.font_of(set_name)
+        if font is None:
+            print '[INF] Skipped the {} char set: no font covers it; assign ' \
+                  'one with -C.'.format(set_name)
+            continue
+        fontmaker.select_font(font, FONT_HEIGHT)    # warm the metrics cache
+        chars_fn, names_fn = fx.char_list(set_name)
+        count = CHAR_SETS[set_name][1]
+        for name, argv in command_variants():
+            dir_name = fx.out_dir('e2e', set_name, name)
+            yield ('e2e.{}.{}'.format(set_name, name), count, measure(
+                lambda: run_command(fx, argv, chars_fn, names_fn, font,
+                                    dir_name), repeat))
+
+    chars_fn, names_fn = fx.char_list('ascii')
+    for name in ['fore', 'outline']:
+        argv = dict(command_variants())[name]
+        dir_name = fx.out_dir('e2e', 'bdf', name)
+        yield ('e2e.bdf.{}'.format(name), CHAR_SETS['ascii'][1], measure(
+            lambda: run_command(fx, argv, chars_fn, names_fn, fx.bdf,
+                                dir_name), repeat))
+
+
+def meta(fx):
+    return {
+        'python': platform.python_version(),
+        'pillow': getattr(PIL, '__version__', getattr(PIL, 'PILLOW_VERSION',
+                                                      None)),
+        'platform': platform.platform(),
+        'font': os.path.basename(fx.ttf),
+        'font_digest': cache.hash_file(fx.ttf),
+        'cjk_font': fx.cjk and os.path.basename(fx.cjk),
+        'fontmaker': fontmaker.__version__,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def run(ttf, sets, repeat, cjk=None):
+    """Run the benchmarks and return the results.
+    """
+    fx = Fixture(ttf, cjk)
+    try:
+        results = {}
+        for bench in [bench_micro(fx, repeat),
+                      bench_commands(fx, sets, repeat)]:
+            for name, count, seconds in bench:
+                results[name] = {
+                    'count': count,
+                    'seconds': round(seconds, 6),
+                    'us_per_item': round(seconds * 1e6 / count, 3),
+                }
+                print '[INF] {:<28} {:>8} {:>12.3f} us'.format(
+                      name, count, seconds * 1e6 / count)
+        return {'meta': meta(fx), 'results': results}
+    finally:
+        fx.close()
+
+
+def compare(base, new):
+    """Print the speedup of each benchmark in both results.
+    """
+    print '{:<28} {:>12} {:>12} {:>8}'.format('benchmark', 'base us',
+                                             'new us', 'speedup')
+    for name in sorted(set(base['results']) & set(new['results'])):
+        b = base['results'][name]['us_per_item']
+        n = new['results'][name]['us_per_item']
+        print '{:<28} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(
+              name, b, n, b / n if n else float('inf'))
+    for name in sorted(set(base['results']) ^ set(new['results'])):
+        print '{:<28} (only in one result)'.format(name)
+
+#------------------------------------------------------------------------------
+# Golden Images
+#------------------------------------------------------------------------------
+
+def picture_digest(fn):
+    """Return the MD5 digest of the size and RGBA pixels of a picture file.
+    """
+    im = Image.open(fn)
+    md5 = hashlib.md5('{}x{}:'.format(*im.size))
+    md5.update(im.convert('RGBA').tobytes())
+    return md5.hexdigest()
+
+
+def dir_digests(dir_name):
+    return dict((fn, picture_digest(os.path.join(dir_name, fn)))
+                for fn in sorted(os.listdir(dir_name))
+                if fn.endswith('.png'))
+
+
+def golden_digests(fx):
+    """Return a {case: {filename: digest}} dict of the pictures of the plain
+    commands, and a list of mismatches of the other command variants.
+    """
+    latin1 = write_lists(fx.dir_name, 'golden',
+                         [CHAR_SETS['ascii'], (0xA0, 0x60)])
+    ascii = fx.char_list('ascii')       # the BDF font has ASCII only
+    digests, mismatches = {}, []
+    for font_name, font, (chars_fn, names_fn) in [('ttf', fx.ttf, latin1),
+                                                  ('bdf', fx.bdf, ascii)]:
+        for size in [12, 24]:
+            for fixed in [[], ['-H']]:
+                argv = ['-n', names_fn, '-f', font, '-s', str(size)] + fixed
+                case = '{}/{}{}'.format(font_name, size, 'H' if fixed else '')
+                variants = [('plain', []), ('jobs', ['-j', '2'])]
+                if has_numpy():
+                    variants.append(('numpy', ['-E', 'numpy']))
+
+                for effect in fontmaker.EFFECTS:
+                    colors = ['-cRed'] if effect == 'fore' else \
+                             ['-cRed', '-lGreen']
+                    for name, extra in variants:
+                        dir_name = fx.out_dir('golden', case, effect, name)
+                        fontmaker.parse_args([effect, '-d', dir_name] + argv +
+                                             colors + extra + [chars_fn])
+                        result = dir_digests(dir_name)
+                        key = '{}/{}'.format(case, effect)
+                        if name == 'plain':
+                            digests[key] = result
+                        elif result != digests[key]:
+                            mismatches.append('{} ({})'.format(key, name))
+
+                all_dir = fx.out_dir('golden', case, 'all')
+                specs = []
+                for effect in fontmaker.EFFECTS:
+                    specs += ['-e', '{}={}'.format(
+                              effect, os.path.join(all_dir, effect))]
+                fontmaker.parse_args(['all', '-cRed', '-lGreen'] + specs +
+                                     argv + [chars_fn])
+                for effect in fontmaker.EFFECTS:
+                    key = '{}/{}'.format(case, effect)
+                    if dir_digests(os.path.join(all_dir, effect)) != \
+                       digests[key]:
+                        mismatches.append('{} (all)'.format(key))
+    return digests, mismatches
+
+
+def golden(ttf, save_fn=None, check_fn=None):
+    """Check the command variants against the plain commands, and save the
+    digests to, or check them against, a golden file. Return the number of
+    mismatches.
+    """
+    fx = Fixture(ttf)
+    try:
+        digests, mismatches = golden_digests(fx)
+        info = meta(fx)
+    finally:
+        fx.close()
+
+    if check_fn:
+        with open(check_fn, 'rb') as f:
+            expected = json.loads(f.read().decode('utf-8'))
+        for key in ['font_digest', 'pillow']:
+            if expected['meta'].get(key) != info[key]:
+                print '[INF] The {} differs from the golden file.'.format(key)
+        for key in sorted(set(digests) | set(expected['digests'])):
+            got, exp = digests.get(key), expected['digests'].get(key)
+            if got != exp:
+                files = sorted(x for x in set(got or {}) | set(exp or {})
+                               if (got or {}).get(x) != (exp or {}).get(x))
+                mismatches.append('{} (golden: {} pictures differ)'.format(
+                                  key, len(files)))
+    if save_fn:
+        with open(save_fn, 'wb') as f:
+            f.write(json.dumps({'meta': info, 'digests': digests}, indent=1,
+                               sort_keys=True, separators=(',', ': ')))
+
+    for x in mismatches:
+        print >> sys.stderr, '[ERR] Mismatched pictures: {}'.format(x)
+    n = sum(len(x) for x in digests.values())
+    print '[INF] {} pictures of {} cases checked; {} mismatches'.format(
+          n, len(digests), len(mismatches))
+    return len(mismatches)
+
+#------------------------------------------------------------------------------
+# Command Line Interface
+#------------------------------------------------------------------------------
+
+def parse_args(args):
+    def char_sets(text):
+        names = [x for x in text.split(',') if x]
+        for x in names:
+            if x not in CHAR_SETS:
+                raise argparse.ArgumentTypeError(
+                    'invalid char set: {!r} (choose from {})'.format(
+                    x, ', '.join(sorted(CHAR_SETS))))
+        return names
+
+    def load(fn):
+        with open(fn, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def do_run(args):
+        results = run(args.font, args.sets, args.repeat, args.cjk_font)
+        if args.outfile:
+            with open(args.outfile, 'wb') as f:
+                f.write(json.dumps(results, indent=1, sort_keys=True,
+                                   separators=(',', ': ')))
+
+    def do_compare(args):
+        compare(load(args.base), load(args.new))
+
+    def do_golden(args):
+        if golden(args.font, args.outfile, args.check):
+            sys.exit(1)
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(help='commands')
+
+    font = argparse.ArgumentParser(add_help=False)
+    font.set_defaults(font=None)
+    font.add_argument('-f', '--font', metavar='<file>',
+        help='''assign a TrueType font file. The default is the first font
+            found of %s.''' % ', '.join(FONT_CANDIDATES))
+
+    sub = subparsers.add_parser('run', parents=[font],
+        help='Run the benchmarks.')
+    sub.set_defaults(func=do_run, sets=DEFAULT_SETS.split(','), repeat=3,
+                     outfile=None, cjk_font=None)
+    sub.add_argument('-C', '--cjk-font', metavar='<file>',
+        help='''assign a font file covering the CJK char sets (3k, 20k).
+            The default is the first font found of %s; a char set no font
+            covers is skipped.''' % ', '.join(CJK_FONT_CANDIDATES))
+    sub.add_argument('-s', '--sets', metavar='<names>', type=char_sets,
+        help='''assign comma-separated char sets of end-to-end commands
+            from %s. The default is "%s".
+            ''' % (', '.join(sorted(CHAR_SETS)), DEFAULT_SETS))
+    sub.add_argument('-r', '--repeat', metavar='<number>', type=int,
+        help='''assign the <number> of runs of a benchmark; the best one
+            counts. The default <number> is "%d".
+            ''' % sub.get_default('repeat'))
+    sub.add_argument('-o', '--outfile', metavar='<file>',
+        help='''assign a <file> to save the results as JSON.''')
+
+    sub = subparsers.add_parser('compare',
+        help='Compare two results of the run command.')
+    sub.set_defaults(func=do_compare)
+    sub.add_argument('base', metavar='base-file', help='The base results.')
+    sub.add_argument('new', metavar='new-file', help='The new results.')
+
+    sub = subparsers.add_parser('golden', parents=[font],
+        help='''Check that faster paths give the same pictures, and save or
+            check golden digests of pictures.''')
+    sub.set_defaults(func=do_golden, outfile=None, check=None)
+    sub.add_argument('-o', '--outfile', metavar='<file>',
+        help='''assign a <file> to save the golden digests.''')
+    sub.add_argument('-c', '--check', metavar='<file>',
+        help='''assign a golden <file> to check the digests against.''')
+
+    args = parser.parse_args(args)
+    args.func(args)
+
+
+def main():
+    try:
+        parse_args(sys.argv[1:])
+    except IOError as err:
+        print err
+    except ValueError as err:
+        print err
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    main()
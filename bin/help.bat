@@ -19,3 +19,12 @@ pause
 
 %fontmaker% shadow21 -h
 pause
+
+%fontmaker% all -h
+pause
+
+%fontmaker% batch -h
+pause
+
+%fontmaker% serve -h
+pause
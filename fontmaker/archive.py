@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+This module streams files into a single archive: a zip file, a tar file
+(plain, gzip, or bzip2), or a tar stream on the standard output. A file is
+added from its bytes as soon as it is made, so neither every file in memory
+nor temporary files are needed. A file identical to an earlier one can be
+added as a hard link member of a tar file; a zip file has no links, so the
+file is stored again.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import io
+import os
+import sys
+import time
+import tarfile
+import zipfile
+import posixpath
+
+
+COMPRESSIONS = ['none', 'deflate', 'gzip', 'bzip2']
+
+
+def archive_format(fn):
+    """Return a (format, default compression) pair of an archive filename;
+    "-" denotes a tar stream on the standard output.
+    """
+    name = fn.lower()
+    if fn == '-':
+        return 'tar', 'none'
+    if name.endswith('.zip'):
+        return 'zip', 'deflate'
+    for exts, compression in [(('.tar.gz', '.tgz'), 'gzip'),
+                              (('.tar.bz2', '.tbz2', '.tbz'), 'bzip2'),
+                              (('.tar',), 'none')]:
+        if name.endswith(exts):
+            return 'tar', compression
+    raise ValueError('Unknown archive format of {}; use .zip, .tar, .tar.gz '
+                     '(.tgz), .tar.bz2 (.tbz2), or - for the standard '
+                     'output.'.format(fn))
+
+
+class Archive(object):
+    """An archive to add files into.
+
+    Arguments
+    ---------
+    fn (str)
+        The filename of the archive (see archive_format).
+    compression (str)
+        One of COMPRESSIONS, or None for the default of the format: deflate
+        or none for a zip file; gzip, bzip2, or none for a tar file.
+    stdout (file)
+        The stream of "-"; the default is sys.stdout.
+    links (bool)
+        Keep the bytes of the files of a zip file for link() to store them
+        again.
+
+    Example
+    -------
+    >>> with Archive('glyphs.zip') as a:
+    ...     a.add(u'out/CH_UPP_A.png', encode_pic(im))
+    """
+    def __init__(self, fn, compression=None, stdout=None, links=False):
+        fmt, default = archive_format(fn)
+        compression = compression or default
+        allowed = ['none', 'deflate'] if fmt == 'zip' else \
+                  ['none', 'gzip', 'bzip2']
+        if compression not in allowed:
+            raise ValueError('A {} archive does not support the {} '
+                             'compression; choose from {}.'.format(
+                             fmt, compression, ', '.join(allowed)))
+        self.fn = fn
+        self.mtime = time.time()
+        self.zip = self.tar = self.stream = self.file = None
+        self.kept = {} if fmt == 'zip' and links else None
+        if fmt == 'zip':
+            self.zip = zipfile.ZipFile(fn, 'w',
+                                       zipfile.ZIP_DEFLATED
+                                       if compression == 'deflate'
+                                       else zipfile.ZIP_STORED,
+                                       allowZip64=True)
+            return
+        mode = 'w|' + {'none': '', 'gzip': 'gz', 'bzip2': 'bz2'}[compression]
+        if fn == '-':
+            self.stream = stdout or sys.stdout
+            if sys.platform == 'win32':
+                import msvcrt
+                msvcrt.setmode(self.stream.fileno(), os.O_BINARY)
+            self.tar = tarfile.open(fileobj=self.stream, mode=mode,
+                                    format=tarfile.PAX_FORMAT,
+                                    encoding='utf-8')
+        else:
+            self.file = open(fn, 'wb')
+            self.tar = tarfile.open(fn, mode, self.file,
+                                    format=tarfile.PAX_FORMAT,
+                                    encoding='utf-8')
+
+    def add(self, name, data):
+        """Add a file of a relative path *name* with its bytes.
+        """
+        name = _member_name(name)
+        if self.kept is not None:
+            self.kept[name] = data
+        if self.zip is not None:
+            info = zipfile.ZipInfo(name, time.localtime(self.mtime)[:6])
+            info.compress_type = self.zip.compression
+            info.external_attr = 0o644 << 16
+            self.zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(self.mtime)
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+
+    def link(self, name, target):
+        """Add a file of a relative path *name* the same as an added file of
+        a relative path *target*: a hard link of a tar file, or a copy of the
+        bytes kept for a zip file (see the *links* argument).
+        """
+        name, target = _member_name(name), _member_name(target)
+        if self.zip is not None:
+            self.add(name, self.kept[target])
+            return
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.LNKTYPE
+        info.linkname = target
+        info.mtime = int(self.mtime)
+        info.mode = 0o644
+        self.tar.addfile(info)
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        else:
+            self.tar.close()
+            if self.file is not None:
+                self.file.close()
+            if self.stream is not None:
+                self.stream.flush()
+
+    def abort(self):
+        """Stop the archive without finishing it, e.g., after an error: an
+        archive file is removed, and a stream is left without the end of the
+        archive, so no reader takes it as complete.
+        """
+        if self.zip is not None:
+            fp, self.zip.fp = self.zip.fp, None     # no central directory
+            fp.close()
+        else:
+            self.tar.fileobj.closed = True      # no end-of-archive blocks
+            self.tar.closed = True
+            if self.file is not None:
+                self.file.close()
+        if self.stream is None:
+            os.remove(self.fn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _member_name(name):
+    return posixpath.normpath(name.replace(os.sep, '/')).lstrip('/')
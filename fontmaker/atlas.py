@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+This module packs character pictures into fixed-size atlas pages (sprite
+sheets) with a skyline bottom-left packer, and writes an index of the glyphs
+as a JSON file and a C header.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import re
+import json
+
+from PIL import Image
+
+from dedup import digest
+from fontcover import codepoint
+
+
+class SkylinePacker(object):
+    """Pack rectangles into a page with the skyline bottom-left heuristic.
+    The skyline is a list of [x, y, width] segments covering the page width.
+    """
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.skyline = [[0, 0, width]]
+
+    def _fit(self, i, w, h):
+        """Return the y to place a w x h rectangle at the i-th segment, or
+        None if it does not fit there.
+        """
+        x = self.skyline[i][0]
+        if x + w > self.width:
+            return None
+        y, remain = 0, w
+        while remain > 0:
+            y = max(y, self.skyline[i][1])
+            if y + h > self.height:
+                return None
+            remain -= self.skyline[i][2]
+            i += 1
+        return y
+
+    def insert(self, w, h):
+        """Place a w x h rectangle and return its (x, y), or None if the page
+        has no room for it.
+        """
+        best = None
+        for i, (x, _y, seg_w) in enumerate(self.skyline):
+            y = self._fit(i, w, h)
+            if y is not None and (best is None or (y + h, seg_w) < best[0]):
+                best = ((y + h, seg_w), i, x, y)
+        if best is None:
+            return None
+
+        _key, i, x, y = best
+        self.skyline.insert(i, [x, y + h, w])
+
+        # cut the segments under the new one
+        end = x + w
+        j = i + 1
+        while j < len(self.skyline) and self.skyline[j][0] < end:
+            seg = self.skyline[j]
+            if seg[0] + seg[2] <= end:
+                del self.skyline[j]
+            else:
+                seg[2] -= end - seg[0]
+                seg[0] = end
+                break
+
+        # merge neighbors of the same level
+        j = 0
+        while j < len(self.skyline) - 1:
+            if self.skyline[j][1] == self.skyline[j+1][1]:
+                self.skyline[j][2] += self.skyline[j+1][2]
+                del self.skyline[j+1]
+            else:
+                j += 1
+        return x, y
+
+
+def pack(sizes, page_size, padding=0):
+    """Return a list of (page, x, y) placements of rectangles in the order of
+    *sizes*, and the number of pages. Rectangles are packed from the tallest
+    one for a denser packing.
+
+    Arguments
+    ---------
+    sizes ((int, int)...)
+        List (width, height) of rectangles.
+    page_size (int, int)
+        The (width, height) of a page.
+    padding (int)
+        The pixels kept empty on the right and bottom of each rectangle.
+    """
+    pw, ph = page_size
+    order = sorted(range(len(sizes)),
+                   key=lambda i: (-sizes[i][1], -sizes[i][0], i))
+    pages = []
+    places = [None] * len(sizes)
+    for i in order:
+        w, h = sizes[i]
+        if w == 0 or h == 0:
+            places[i] = (0, 0, 0)
+            continue
+        w, h = w + padding, h + padding
+        if w > pw or h > ph:
+            raise ValueError('a {}x{} picture is larger than the {}x{} atlas '
+                             'page'.format(sizes[i][0], sizes[i][1], pw, ph))
+        for page, packer in enumerate(pages):
+            xy = packer.insert(w, h)
+            if xy is not None:
+                break
+        else:
+            pages.append(SkylinePacker(pw, ph))
+            page = len(pages) - 1
+            xy = pages[page].insert(w, h)
+        places[i] = (page,) + xy
+    return places, max(len(pages), 1)
+
+
+def build_pages(images, page_size, padding=0, dedup=False):
+    """Pack pictures into atlas pages. Return a (pages, placements) pair,
+    where placements lists a (page, x, y) of each picture. With *dedup*,
+    identical pictures are packed once and share a placement.
+
+    All pictures must be in the same mode; paletted pictures share the
+    palette of the first one, and the background of a paletted page takes
+    the index 0 (the background of a decorated picture).
+    """
+    if dedup:
+        firsts = {}
+        origins = [firsts.setdefault(digest([im]), i)
+                   for i, im in enumerate(images)]
+    else:
+        origins = range(len(images))
+    uniques = sorted(set(origins))
+    places, n_pages = pack([images[i].size for i in uniques], page_size,
+                           padding)
+    mode = images[0].mode if images else 'RGBA'
+    pages = [Image.new(mode, page_size, 0) for _ in range(n_pages)]
+    if mode == 'P':
+        for page in pages:
+            page.putpalette(images[0].palette.getdata()[1])
+    for i, (page, x, y) in zip(uniques, places):
+        if images[i].size[0] and images[i].size[1]:
+            pages[page].paste(images[i], (x, y))
+    places = dict(zip(uniques, places))
+    return pages, [places[i] for i in origins]
+
+#------------------------------------------------------------------------------
+
+def c_name(name):
+    """Return a C identifier made from a name.
+    """
+    name = re.sub(r'\W', '_', name)
+    return '_' + name if name[:1].isdigit() else name
+
+
+def page_filename(name, page):
+    return '{}_{}.png'.format(name, page)
+
+
+def save_index_json(fn, name, chars, images, places, page_size, n_pages):
+    """Save the glyph index of an atlas as a JSON file.
+    """
+    glyphs = []
+    for ch, im, (page, x, y) in zip(chars, images, places):
+        w, h = im.size
+        glyphs.append({'char': ch, 'codepoint': codepoint(ch), 'page': page,
+                       'x': x, 'y': y, 'width': w, 'height': h})
+    index = {
+        'page_size': list(page_size),
+        'pages': [page_filename(name, i) for i in range(n_pages)],
+        'glyphs': glyphs,
+    }
+    with open(fn, 'wb') as f:
+        f.write(json.dumps(index, indent=1, sort_keys=True,
+                           separators=(',', ': ')).encode('utf-8'))
+
+
+def save_index_header(fn, name, chars, images, places, page_size, n_pages):
+    """Save the glyph index of an atlas as a C header. The glyphs are sorted
+    by codepoint for a binary search.
+    """
+    ident = c_name(name)
+    macro = ident.upper()
+    rows = sorted((codepoint(ch), page, x, y, im.size[0], im.size[1])
+                  for ch, im, (page, x, y) in zip(chars, images, places))
+    lines = [
+        '/* Generated by Font Maker. Do not edit. */',
+        '#ifndef {}_ATLAS_H'.format(macro),
+        '#define {}_ATLAS_H'.format(macro),
+        '',
+        '#define {}_PAGE_WIDTH  {}'.format(macro, page_size[0]),
+        '#define {}_PAGE_HEIGHT {}'.format(macro, page_size[1]),
+        '#define {}_PAGE_COUNT  {}'.format(macro, n_pages),
+        '#define {}_GLYPH_COUNT {}'.format(macro, len(rows)),
+        '',
+        'typedef struct {',
+        '    unsigned long codepoint;',
+        '    unsigned short page, x, y, width, height;',
+        '}} {}_glyph_t;'.format(ident),
+        '',
+        '/* sorted by codepoint */',
+        'static const {0}_glyph_t {0}_glyphs[] = {{'.format(ident),
+    ]
+    lines += ['    {{0x{:04X}, {}, {}, {}, {}, {}}},'.format(*row)
+              for row in rows]
+    lines += [
+        '};',
+        '',
+        '#endif /* {}_ATLAS_H */'.format(macro),
+        '',
+    ]
+    with open(fn, 'wb') as f:
+        f.write('\n'.join(lines).encode('ascii'))
+
+
+def save_atlas(dir_name, name, chars, images, page_size, padding=0,
+               bits=None, dedup=False, png_options=None):
+    """Pack pictures of characters into atlas pages, and save the pages as
+    <name>_<n>.png with the index files <name>.json and <name>.h in a
+    directory. The *bits* assigns the bit depth of paletted pages; with
+    *dedup*, index entries of identical pictures share a placement. The
+    *png_options* is a dict of keyword arguments of saving a page, e.g.,
+    {'compress_level': 9}.
+    """
+    pages, places = build_pages(images, page_size, padding, dedup)
+    for i, page in enumerate(pages):
+        fn = os.path.join(dir_name, page_filename(name, i))
+        kwargs = dict(png_options or {})
+        if page.mode == 'P':
+            kwargs['transparency'] = 0
+            if bits:
+                kwargs['bits'] = bits
+        page.save(fn, **kwargs)
+    base = os.path.join(dir_name, name)
+    for save_index, ext in [(save_index_json, '.json'),
+                            (save_index_header, '.h')]:
+        save_index(base + ext, name, chars, images, places, page_size,
+                   len(pages))
+    return pages, places
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+A small on-disk cache keyed by the content hash of font files. Entries are
+JSON files grouped by kind under the cache directory, e.g.,
+<cache-dir>/metrics/<sha1 of font file>.json, or files made by a function,
+e.g., <cache-dir>/pilfont/<sha1 of font file>.pil and .pbm.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import json
+import shutil
+import atexit
+import hashlib
+import tempfile
+
+
+CACHE_ENV = 'FONTMAKER_CACHE'
+
+
+def cache_dir():
+    """Return the cache directory. The FONTMAKER_CACHE environment variable
+    overrides the default "~/.fontmaker/cache".
+    """
+    path = os.environ.get(CACHE_ENV)
+    if not path:
+        path = os.path.join(os.path.expanduser('~'), '.fontmaker', 'cache')
+    return path
+
+
+_digests = {}
+
+def file_digest(fn):
+    """Return the SHA-1 hex digest of the content of a file. The digest is
+    memorized per (path, size, mtime) in the current process.
+    """
+    st = os.stat(fn)
+    key = (os.path.abspath(fn), st.st_size, st.st_mtime)
+    if key not in _digests:
+        _digests[key] = hash_file(fn)
+    return _digests[key]
+
+
+def hash_file(fn):
+    """Return the SHA-1 hex digest of the content of a file.
+    """
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def entry_path(kind, key, ext='.json'):
+    """Return the path of a cache entry.
+    """
+    return os.path.join(cache_dir(), kind, key + ext)
+
+
+def atomic_write(fn, data):
+    """Write *data* (bytes) into a file via a temporary file and a rename, so
+    concurrent readers never see a partial file.
+    """
+    dir_name = os.path.dirname(fn)
+    if not os.path.isdir(dir_name):
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            if not os.path.isdir(dir_name):
+                raise
+    fd, tmp = tempfile.mkstemp(dir=dir_name, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.name == 'nt' and os.path.exists(fn):
+            os.remove(fn)
+        os.rename(tmp, fn)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load(kind, key):
+    """Return the JSON object of a cache entry, or None if it is missing or
+    unreadable.
+    """
+    try:
+        with open(entry_path(kind, key), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save(kind, key, obj):
+    """Save a JSON object as a cache entry. Failures (e.g., a read-only cache
+    directory) are ignored since the cache is only an accelerator.
+    """
+    data = json.dumps(obj, sort_keys=True).encode('utf-8')
+    try:
+        atomic_write(entry_path(kind, key), data)
+    except (IOError, OSError):
+        pass
+
+
+def file_entry(kind, key, exts, make):
+    """Return the base path (without extension) of a cache entry of files
+    with extensions *exts*, e.g., ['.pbm', '.pil']. A missing entry is made
+    by make(base) at a temporary base path and moved into place by a rename
+    per file in the order of *exts*, so concurrent processes see the whole
+    entry once its last file exists. If the cache directory is not
+    writable, the entry is made in a temporary directory of this process.
+    """
+    base = entry_path(kind, key, '')
+    if os.path.isfile(base + exts[-1]):
+        return base
+    dir_name = os.path.dirname(base)
+    try:
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        tmp_dir = tempfile.mkdtemp(dir=dir_name, prefix='.tmp-')
+    except (IOError, OSError):
+        if not os.path.isdir(dir_name) or not os.access(dir_name, os.W_OK):
+            base = os.path.join(_private_dir(), kind + '-' + key)
+            make(base)
+            return base
+        raise
+    try:
+        tmp = os.path.join(tmp_dir, key)
+        make(tmp)
+        for ext in exts:
+            if os.name == 'nt' and os.path.exists(base + ext):
+                os.remove(base + ext)
+            os.rename(tmp + ext, base + ext)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return base
+
+
+def _private_dir():
+    """Return a temporary directory removed at the exit of this process.
+    """
+    global _private
+    if _private is None:
+        _private = tempfile.mkdtemp(prefix='fontmaker-')
+        atexit.register(shutil.rmtree, _private, True)
+    return _private
+
+_private = None
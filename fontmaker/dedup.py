@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+This module finds characters drawn into identical bitmaps, e.g., the same
+missing-glyph box of every character a font lacks. The pictures of such a
+character are not generated again but aliased to the pictures of the first
+character of the same drawing: a hard link of a picture file, or a shared
+entry in atlas pages and exported fonts. The deduplication is off until
+enable() is called.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import json
+import shutil
+import hashlib
+from collections import OrderedDict
+
+from fontcover import codepoint
+
+
+def digest(ims):
+    """Return a digest of the modes, sizes, and pixels of pictures; a picture
+    listed more than once counts once.
+    """
+    md5 = hashlib.md5()
+    seen = set()
+    for im in ims:
+        if id(im) in seen:
+            continue
+        seen.add(id(im))
+        md5.update('{}:{}x{}:'.format(im.mode, *im.size).encode('ascii'))
+        if im.size[0] and im.size[1]:
+            md5.update(im.tobytes())
+    return md5.hexdigest()
+
+
+def link(src, dst):
+    """Make *dst* a hard link of *src*, or a copy where hard links are not
+    supported.
+    """
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except (AttributeError, OSError):
+        shutil.copyfile(src, dst)
+
+
+class Dedup(object):
+    """A table of the first filenames and the characters of each drawing.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()    # digest -> [first filenames, chars]
+        self.aliased = set()            # (digest, char) of duplicates
+        self.records = []               # (digest, char, filenames) added
+
+    def add(self, key, ch, fns):
+        """Add a character of a drawing, and return the filenames of the first
+        character of the drawing if it is a duplicate, or else None.
+        """
+        self.records.append((key, ch, fns))
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = [fns, [ch]]
+            return None
+        if entry[1][0] == ch:   # the first character again, e.g., a retry
+            return None
+        if (key, ch) not in self.aliased:
+            self.aliased.add((key, ch))
+            entry[1].append(ch)
+        return entry[0]
+
+    def groups(self):
+        """Return a list of (first filenames, chars) of drawings shared by
+        several characters, the largest group first.
+        """
+        groups = [tuple(x) for x in self.entries.values() if len(x[1]) > 1]
+        return sorted(groups, key=lambda x: -len(x[1]))
+
+
+_dedup = None
+
+
+def enable():
+    global _dedup
+    _dedup = Dedup()
+
+
+def disable():
+    global _dedup
+    _dedup = None
+
+
+def enabled():
+    return _dedup is not None
+
+
+def add(key, ch, fns=()):
+    return _dedup.add(key, ch, fns)
+
+
+def take():
+    """Return the records added since the last call; None if disabled. A
+    worker process keeps its table to find duplicates across its chunks.
+    """
+    if _dedup is None:
+        return None
+    records, _dedup.records = _dedup.records, []
+    return records
+
+
+def merge(records):
+    """Merge the records of a worker process in order, and alias the pictures
+    of a duplicate found only across processes.
+    """
+    if _dedup is None or not records:
+        return
+    for key, ch, fns in records:
+        first = _dedup.add(key, ch, fns)
+        if first is not None:
+            for src, dst in zip(first, fns):
+                link(src, dst)
+
+#------------------------------------------------------------------------------
+
+def report():
+    """Return a dict of the characters collapsed into shared drawings.
+    """
+    groups = []
+    for fns, chars in _dedup.groups():
+        groups.append({
+            'chars': u''.join(chars),
+            'codepoints': ['U+{:04X}'.format(codepoint(x)) for x in chars],
+            'filenames': list(fns),
+        })
+    return {
+        'glyphs': sum(len(x[1]) for x in _dedup.entries.values()),
+        'unique': len(_dedup.entries),
+        'groups': groups,
+    }
+
+
+def format_report(rep, max_groups=10, max_chars=8):
+    """Return lines of a human-readable summary of a report().
+    """
+    collapsed = sum(len(x['codepoints']) for x in rep['groups'])
+    lines = ['[INF] {} glyphs drawn into {} distinct bitmaps; {} characters '
+             'collapsed into {} shared bitmaps'.format(
+             rep['glyphs'], rep['unique'], collapsed, len(rep['groups']))]
+    for group in rep['groups'][:max_groups]:
+        cps = group['codepoints']
+        more = ' ...' if len(cps) > max_chars else ''
+        lines.append('[INF]   {} characters: {}{}'.format(
+                     len(cps), ' '.join(cps[:max_chars]), more))
+    if len(rep['groups']) > max_groups:
+        lines.append('[INF]   ... {} more groups'.format(
+                     len(rep['groups']) - max_groups))
+    return lines
+
+
+def save_report(fn, rep):
+    with open(fn, 'wb') as f:
+        f.write(json.dumps(rep, indent=1, sort_keys=True,
+                           separators=(',', ': ')).encode('utf-8'))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+This module exports pictures of characters as a font for embedded targets: a
+binary font blob and/or a C source/header pair. Pixels are packed at 1, 2, 4,
+or 8 bits per pixel; a glyph is optionally compressed with a per-row RLE.
+
+Pixel values
+------------
+The value of a pixel of a paletted picture is its palette index, i.e., 0 for
+background, 1 for outline/shadow, and 2 for foreground of a decorated picture.
+The value of a pixel of a RGBA picture is its alpha scaled to the bit depth.
+
+Bitmap encodings
+----------------
+RAW (0)
+    Rows of packed pixels, most significant bits first; each row starts at a
+    byte boundary.
+RLE (1)
+    Runs of same pixels in each row, a byte per run: the low *bpp* bits are
+    the pixel value and the remaining high bits are the run length minus 1.
+    A run never crosses rows. With 8 bits per pixel, a run takes two bytes:
+    the run length minus 1, then the pixel value.
+
+Binary blob layout (little-endian)
+----------------------------------
+header (16 bytes)
+    magic "FMFT", version (u8), bpp (u8), reserved (u16), glyph count
+    (u32), max glyph height (u16), reserved (u16)
+glyph table (20 bytes per glyph, sorted by codepoint)
+    codepoint (u32), bitmap offset (u32), bitmap size (u32), width (u16),
+    height (u16), encoding (u8), reserved (3 bytes)
+bitmaps
+    The bitmap offsets count from the beginning of this area. Glyphs of an
+    identical bitmap may share an offset.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import struct
+
+from atlas import c_name
+from fontcover import codepoint
+
+
+MAGIC = b'FMFT'
+VERSION = 1
+
+RAW, RLE = 0, 1
+
+_HEADER = struct.Struct('<4sBBHIHH')
+_GLYPH = struct.Struct('<IIIHHB3x')
+
+
+def pixel_values(im, bpp):
+    """Return rows of pixel values of a picture at given bits per pixel.
+    """
+    w, h = im.size
+    if im.mode == 'P':
+        data = bytearray(im.tobytes()) if w and h else bytearray()
+        if data and max(data) >= 1 << bpp:
+            raise ValueError('Palette index {} cannot be exported in {} '
+                             'bit(s) per pixel.'.format(max(data), bpp))
+    else:
+        alpha = im.convert('RGBA').split()[3]
+        data = bytearray(alpha.tobytes()) if w and h else bytearray()
+        data = bytearray(x >> (8 - bpp) for x in data)
+    return [data[y*w:(y+1)*w] for y in range(h)]
+
+
+def pack_raw(rows, bpp):
+    """Pack rows of pixel values; each row starts at a byte boundary.
+    """
+    per_byte = 8 // bpp
+    out = bytearray()
+    for row in rows:
+        for i in range(0, len(row), per_byte):
+            byte = 0
+            for j, v in enumerate(row[i:i+per_byte]):
+                byte |= v << (8 - bpp * (j + 1))
+            out.append(byte)
+    return bytes(out)
+
+
+def pack_rle(rows, bpp):
+    """Pack rows of pixel values with the per-row RLE.
+    """
+    max_run = 256 if bpp == 8 else 1 << (8 - bpp)
+    out = bytearray()
+    for row in rows:
+        i = 0
+        while i < len(row):
+            v = row[i]
+            n = 1
+            while i + n < len(row) and row[i+n] == v and n < max_run:
+                n += 1
+            if bpp == 8:
+                out += bytearray([n - 1, v])
+            else:
+                out.append(((n - 1) << bpp) | v)
+            i += n
+    return bytes(out)
+
+
+def encode_glyph(im, bpp, rle=False):
+    """Return an (encoding, bitmap) pair of a picture. With *rle*, the RLE
+    encoding is taken only if it is smaller than the raw one.
+    """
+    rows = pixel_values(im, bpp)
+    raw = pack_raw(rows, bpp)
+    if rle:
+        packed = pack_rle(rows, bpp)
+        if len(packed) < len(raw):
+            return RLE, packed
+    return RAW, raw
+
+
+def encode_font(chars, images, bpp, rle=False, dedup=False):
+    """Return a list of (codepoint, width, height, encoding, offset, bitmap)
+    tuples sorted by codepoint. With *dedup*, glyphs of an identical encoded
+    bitmap share the offset of the first one.
+    """
+    glyphs = []
+    for ch, im in sorted(zip(chars, images), key=lambda x: codepoint(x[0])):
+        encoding, bitmap = encode_glyph(im, bpp, rle)
+        glyphs.append([codepoint(ch), im.size[0], im.size[1], encoding, bitmap])
+
+    offset = 0
+    offsets = {}
+    for g in glyphs:
+        key = tuple(g[3:])
+        if dedup and key in offsets:
+            g.insert(4, offsets[key])
+            continue
+        offsets[key] = offset
+        g.insert(4, offset)
+        offset += len(g[-1])
+    return [tuple(g) for g in glyphs]
+
+
+def stored_glyphs(glyphs):
+    """Yield the glyphs storing their bitmaps in the order of offsets, i.e.,
+    all but the ones sharing an earlier bitmap (see encode_font).
+    """
+    end = 0
+    for g in glyphs:
+        if g[4] == end:
+            end += len(g[-1])
+            yield g
+
+#------------------------------------------------------------------------------
+
+def save_bin(fn, glyphs, bpp):
+    """Save encoded glyphs as a binary font blob.
+    """
+    max_h = max([g[2] for g in glyphs] or [0])
+    with open(fn, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, bpp, 0, len(glyphs), max_h, 0))
+        for cp, w, h, encoding, offset, bitmap in glyphs:
+            f.write(_GLYPH.pack(cp, offset, len(bitmap), w, h, encoding))
+        for g in stored_glyphs(glyphs):
+            f.write(g[-1])
+
+
+def save_c(fn_c, fn_h, name, glyphs, bpp):
+    """Save encoded glyphs as a C source file and its header.
+    """
+    ident = c_name(name)
+    macro = ident.upper()
+    size = sum(len(g[-1]) for g in stored_glyphs(glyphs))
+    max_h = max([g[2] for g in glyphs] or [0])
+    header = [
+        '/* Generated by Font Maker. Do not edit. */',
+        '#ifndef {}_FONT_H'.format(macro),
+        '#define {}_FONT_H'.format(macro),
+        '',
+        '#include <stdint.h>',
+        '',
+        '#define {}_BPP          {}'.format(macro, bpp),
+        '#define {}_GLYPH_COUNT  {}'.format(macro, len(glyphs)),
+        '#define {}_MAX_HEIGHT   {}'.format(macro, max_h),
+        '#define {}_ENC_RAW      {}'.format(macro, RAW),
+        '#define {}_ENC_RLE      {}'.format(macro, RLE),
+        '',
+        'typedef struct {',
+        '    uint32_t codepoint;',
+        '    uint32_t offset;        /* offset in {}_bitmaps */'.format(ident),
+        '    uint16_t width, height;',
+        '    uint8_t encoding;',
+        '}} {}_glyph_t;'.format(ident),
+        '',
+        '/* sorted by codepoint */',
+        'extern const {0}_glyph_t {0}_glyphs[{1}];'.format(ident, len(glyphs)),
+        'extern const uint8_t {}_bitmaps[{}];'.format(ident, size),
+        '',
+        '#endif /* {}_FONT_H */'.format(macro),
+        '',
+    ]
+
+    source = [
+        '/* Generated by Font Maker. Do not edit. */',
+        '#include "{}"'.format(fn_h.replace('\\', '/').split('/')[-1]),
+        '',
+        'const {0}_glyph_t {0}_glyphs[{1}] = {{'.format(ident, len(glyphs)),
+    ]
+    source += ['    {{0x{:04X}, {}, {}, {}, {}}},'.format(cp, offset, w, h,
+                                                          encoding)
+               for cp, w, h, encoding, offset, _bitmap in glyphs]
+    source += [
+        '};',
+        '',
+        'const uint8_t {}_bitmaps[{}] = {{'.format(ident, size),
+    ]
+    for cp, _w, _h, _encoding, _offset, bitmap in stored_glyphs(glyphs):
+        source.append('    /* U+{:04X} */'.format(cp))
+        data = bytearray(bitmap)
+        for i in range(0, len(data), 12):
+            source.append('    ' + ' '.join('0x{:02X},'.format(x)
+                                            for x in data[i:i+12]))
+    source += ['};', '']
+
+    for fn, lines in [(fn_h, header), (fn_c, source)]:
+        with open(fn, 'wb') as f:
+            f.write('\n'.join(lines).encode('ascii'))
+
+
+def save_export(dir_name, name, chars, images, bpp, rle=False,
+                formats=('bin', 'c'), dedup=False):
+    """Export pictures of characters as <name>.bin and/or <name>.c/<name>.h
+    in a directory.
+    """
+    glyphs = encode_font(chars, images, bpp, rle, dedup)
+    base = os.path.join(dir_name, name)
+    if 'bin' in formats:
+        save_bin(base + '.bin', glyphs, bpp)
+    if 'c' in formats:
+        save_c(base + '.c', base + '.h', name, glyphs, bpp)
+    return glyphs
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+This module finds the codepoints a font covers, i.e., the characters mapped
+to glyphs by the cmap table of a TrueType/OpenType font or listed in a PIL
+bitmap font, and indexes the coverage of several fonts of a fallback chain
+into a lookup table from a codepoint to the first font covering it. The
+coverage of a font file is kept as sorted [first, last] ranges in the on-disk
+cache keyed by the content hash of the file.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import struct
+from bisect import bisect_right
+
+import cache
+
+
+MAX_CODEPOINT = 0x10FFFF
+
+
+def codepoint(ch):
+    """Return the codepoint of a character; a surrogate pair on a narrow
+    Python build counts as one character.
+    """
+    if len(ch) == 2 and u'\ud800' <= ch[0] <= u'\udbff':
+        return 0x10000 + ((ord(ch[0]) - 0xD800) << 10) + ord(ch[1]) - 0xDC00
+    return ord(ch)
+
+
+def merge_ranges(ranges):
+    """Return sorted [first, last] ranges merging overlapped and adjacent
+    ones of (first, last) pairs.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def _runs(cps):
+    """Yield (first, last) pairs of runs of sorted codepoints.
+    """
+    first = last = None
+    for cp in cps:
+        if last is not None and cp == last + 1:
+            last = cp
+            continue
+        if first is not None:
+            yield first, last
+        first = last = cp
+    if first is not None:
+        yield first, last
+
+#------------------------------------------------------------------------------
+
+def sfnt_ranges(data):
+    """Return (first, last) pairs of codepoints mapped to glyphs by the
+    Unicode subtables of the cmap table of TrueType/OpenType font data; the
+    first font of a collection (.ttc) is read.
+    """
+    u16 = lambda pos: struct.unpack_from('>H', data, pos)[0]
+    u32 = lambda pos: struct.unpack_from('>I', data, pos)[0]
+
+    base = u32(12) if data[:4] == b'ttcf' else 0
+    cmap = None
+    for i in range(u16(base + 4)):
+        rec = base + 12 + i * 16
+        if data[rec:rec+4] == b'cmap':
+            cmap = u32(rec + 8)
+            break
+    if cmap is None:
+        raise ValueError('No cmap table in the font.')
+
+    ranges = []
+    offsets = set()
+    for i in range(u16(cmap + 2)):
+        rec = cmap + 4 + i * 8
+        platform, encoding = u16(rec), u16(rec + 2)
+        if platform != 0 and (platform, encoding) not in [(3, 1), (3, 10)]:
+            continue
+        offset = cmap + u32(rec + 4)
+        if offset not in offsets:
+            offsets.add(offset)
+            ranges += _subtable_ranges(data, offset)
+    return ranges
+
+
+def _subtable_ranges(data, pos):
+    """Return (first, last) pairs of codepoints mapped to nonzero glyphs by a
+    cmap subtable of format 0, 4, 6, 10, 12, or 13; other formats (e.g., the
+    variation sequences of format 14) map no codepoints of their own.
+    """
+    u16 = lambda pos: struct.unpack_from('>H', data, pos)[0]
+    u32 = lambda pos: struct.unpack_from('>I', data, pos)[0]
+    fmt = u16(pos)
+
+    if fmt == 0:
+        glyphs = bytearray(data[pos+6:pos+6+256])
+        return list(_runs(cp for cp in range(256) if glyphs[cp]))
+
+    if fmt == 4:
+        n = u16(pos + 6) // 2
+        ends, starts = pos + 14, pos + 16 + n * 2
+        deltas, range_offsets = starts + n * 2, starts + n * 4
+        cps = []
+        for i in range(n):
+            first, last = u16(starts + i*2), u16(ends + i*2)
+            delta, ro = u16(deltas + i*2), u16(range_offsets + i*2)
+            if first == 0xFFFF:
+                continue
+            for cp in range(first, last + 1):
+                if ro == 0:
+                    glyph = (cp + delta) & 0xFFFF
+                else:
+                    glyph = u16(range_offsets + i*2 + ro + (cp - first) * 2)
+                    glyph = glyph and (glyph + delta) & 0xFFFF
+                if glyph:
+                    cps.append(cp)
+        return list(_runs(cps))
+
+    if fmt in (6, 10):
+        if fmt == 6:
+            first, count, glyphs = u16(pos + 6), u16(pos + 8), pos + 10
+        else:
+            first, count, glyphs = u32(pos + 12), u32(pos + 16), pos + 20
+        return list(_runs(first + i for i in range(count)
+                          if u16(glyphs + i*2)))
+
+    if fmt in (12, 13):
+        ranges = []
+        for i in range(u32(pos + 12)):
+            group = pos + 16 + i * 12
+            first, last, glyph = u32(group), u32(group + 4), u32(group + 8)
+            if glyph == 0:
+                if fmt == 13:
+                    continue
+                first += 1      # the glyph 0 of the first one is missing
+            if first <= last:
+                ranges.append((first, min(last, MAX_CODEPOINT)))
+        return ranges
+
+    return []
+
+
+def pil_ranges(data):
+    """Return (first, last) pairs of the codepoints (0-255) of glyphs in a
+    PIL bitmap font (.pil); a missing glyph has zero metrics.
+    """
+    pos = 0
+    while True:
+        end = data.index(b'\n', pos) + 1
+        line, pos = data[pos:end], end
+        if line == b'DATA\n':
+            break
+    metrics = struct.unpack_from('>2560h', data, pos)
+    return list(_runs(cp for cp in range(256)
+                      if any(metrics[cp*10:cp*10+10])))
+
+
+def font_ranges(filename):
+    """Return sorted [first, last] ranges of the codepoints a font file (a
+    TrueType/OpenType font or a PIL bitmap font) covers. The ranges are
+    loaded from (or saved to) the on-disk cache keyed by the content hash of
+    the font file.
+    """
+    key = cache.file_digest(filename)
+    if key not in _ranges:
+        ranges = cache.load('coverage', key)
+        if ranges is None:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            try:
+                if data.startswith(b'PILfont\n'):
+                    ranges = merge_ranges(pil_ranges(data))
+                else:
+                    ranges = merge_ranges(sfnt_ranges(data))
+            except (struct.error, ValueError) as err:
+                raise ValueError('{}: unreadable character map ({})'.format(
+                                 filename, err))
+            cache.save('coverage', key, ranges)
+        _ranges[key] = ranges
+    return _ranges[key]
+
+_ranges = {}
+
+#------------------------------------------------------------------------------
+
+class Index(object):
+    """A lookup table from a codepoint to the index of the first font
+    covering it among several fonts.
+
+    Arguments
+    ---------
+    coverages ([[first, last]...]...)
+        List sorted ranges of codepoints of each font in the order of
+        preference; None for a font covering every codepoint.
+
+    Example
+    -------
+    >>> index = Index([[[65, 90]], [[48, 57], [65, 122]]])
+    >>> [index.lookup(x) for x in (ord('A'), ord('a'), ord('0'), ord('!'))]
+    [0, 1, 1, None]
+    """
+    def __init__(self, coverages):
+        coverages = [x if x is not None else [[0, MAX_CODEPOINT]]
+                     for x in coverages]
+        firsts = [[x[0] for x in ranges] for ranges in coverages]
+        bounds = set([0])
+        for ranges in coverages:
+            for first, last in ranges:
+                bounds.update((first, last + 1))
+
+        def first_font(cp):
+            for i, ranges in enumerate(coverages):
+                k = bisect_right(firsts[i], cp) - 1
+                if k >= 0 and cp <= ranges[k][1]:
+                    return i
+            return None
+
+        # each segment of codepoints between bounds has one first font
+        self.starts, self.fonts = [], []
+        for cp in sorted(bounds):
+            font = first_font(cp)
+            if not self.fonts or self.fonts[-1] != font:
+                self.starts.append(cp)
+                self.fonts.append(font)
+
+    def lookup(self, cp):
+        """Return the index of the first font covering a codepoint, or None
+        if no font covers it.
+        """
+        return self.fonts[bisect_right(self.starts, cp) - 1]
+
+    def uncovered(self, chars):
+        """Return a list of distinct characters no font covers in order.
+        """
+        seen = set()
+        missing = []
+        for ch in chars:
+            if ch not in seen:
+                seen.add(ch)
+                if self.lookup(codepoint(ch)) is None:
+                    missing.append(ch)
+        return missing
@@ -11,14 +11,34 @@ __author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
 __date__ = "2016/04/19 (initial version); 2019/03/20 (last revision)"
 
 import os
+import re
 import sys
-from itertools import izip
+import io
+import json
+import time
+import base64
+import shutil
+from itertools import izip, islice
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 import argparse
 
 from PIL import ImageFont, Image, ImageDraw, ImageColor
 from PIL import BdfFontFile, PcfFontFile
 
 import decor
+import blocks
+import cache
+import fontcover
+import atlas
+import export
+import manifest
+import stats
+import dedup
+import writer
+import server
+import shard
+import archive
 
 #------------------------------------------------------------------------------
 # Text File Read/Write
@@ -42,25 +62,151 @@ def read_unicode(fn):
     return us
 
 
-def read_char_list(fn):
-    lines = read_unicode(fn).splitlines()
+def iter_unicode_lines(fn):
+    """Yield lines of an Unicode file (see read_unicode) one by one without
+    reading the whole file.
+    """
+    from codecs import BOM_UTF16_LE, BOM_UTF16_BE
+
+    with open(fn, "rb") as in_file:
+        bom = in_file.read(2)
+    if bom in (BOM_UTF16_LE, BOM_UTF16_BE):
+        encoding = "utf_16"
+    else:
+        encoding = "utf_8_sig"
+
+    with io.open(fn, encoding=encoding) as in_file:
+        for line in in_file:
+            yield line
+
+
+def _iter_list_lines(fn):
+    """Yield the lines of a list file, skipping empty lines, comment lines
+    (prefixing '#'), and lines prefixing ':'.
+    """
+    lines = iter_unicode_lines(fn)
     lines = (x.rstrip() for x in lines)
     lines = (x for x in lines if len(x) > 0 and not x.startswith('#'))
-    lines = (x for x in lines if not x.startswith(':'))
-    chars = []
-    for line in lines:
-        chars += line
+    return (x for x in lines if not x.startswith(':'))
+
+
+_RANGE_RE = re.compile(
+    r'U\+([0-9A-Fa-f]{1,6})(?:\.\.(?:U\+)?([0-9A-Fa-f]{1,6}))?$')
+_BLOCK_RE = re.compile(r'\[([A-Za-z][\w \-]*)\]$')
+
+
+def char_ranges(line):
+    """Return a list of (first, last) codepoints of a range directive line,
+    or None if the line lists literal characters.
+
+    A range directive line is a known block name in brackets, or ranges
+    like U+4E00..U+9FFF or U+3000 separated by spaces or commas; a bracketed
+    name of no block (e.g., [abc]) lists literal characters.
+
+    Example
+    -------
+    >>> char_ranges(u'U+0030..U+0039, U+0041')
+    [(48, 57), (65, 65)]
+    >>> char_ranges(u'[Basic Latin]')
+    [(0, 127)]
+    >>> char_ranges(u'ABC') is None
+    True
+    >>> char_ranges(u'[abc]') is None
+    True
+    """
+    m = _BLOCK_RE.match(line)
+    if m:
+        block = blocks.find_block(m.group(1))
+        return [block] if block is not None else None
+
+    ranges = []
+    for word in line.replace(',', ' ').split():
+        m = _RANGE_RE.match(word)
+        if m is None:
+            return None
+        first = int(m.group(1), 16)
+        last = int(m.group(2), 16) if m.group(2) else first
+        if not first <= last <= 0x10FFFF:
+            raise ValueError('Invalid character range: {}'.format(word))
+        ranges.append((first, last))
+    return ranges
+
+
+def _unichr(cp):
+    """Return the character of a codepoint; a surrogate pair on a narrow
+    Python build for a codepoint beyond U+FFFF.
+    """
+    try:
+        return unichr(cp)
+    except ValueError:
+        return ('\\U%08x' % cp).decode('unicode_escape')
+
+
+def _iter_chars(line):
+    """Yield characters of a line; a surrogate pair on a narrow Python
+    build is yielded as one character, the same as _unichr() returns it.
+    """
+    i, n = 0, len(line)
+    while i < n:
+        if (i + 1 < n and u'\ud800' <= line[i] <= u'\udbff'
+                and u'\udc00' <= line[i+1] <= u'\udfff'):
+            yield line[i:i+2]
+            i += 2
+        else:
+            yield line[i]
+            i += 1
+
+
+def _is_char(cp):
+    """Check if a codepoint is neither a surrogate nor a noncharacter.
+    """
+    return not (0xD800 <= cp <= 0xDFFF or 0xFDD0 <= cp <= 0xFDEF
+                or cp & 0xFFFE == 0xFFFE)
 
-    return chars
+
+def iter_char_list(fn):
+    """Yield characters of a char list file one by one. Besides lines of
+    literal characters, a line can list ranges of characters (see
+    char_ranges); surrogates and noncharacters in a range are skipped.
+    """
+    for line in _iter_list_lines(fn):
+        ranges = char_ranges(line)
+        if ranges is None:
+            for ch in _iter_chars(line):
+                yield ch
+            continue
+        for first, last in ranges:
+            for cp in xrange(first, last+1):
+                if _is_char(cp):
+                    yield _unichr(cp)
+
+
+def read_char_list(fn):
+    return list(iter_char_list(fn))
 
 
 def read_filename_list(fn):
-    lines = read_unicode(fn).splitlines()
-    lines = (x.rstrip() for x in lines)
-    lines = (x for x in lines if len(x) > 0 and not x.startswith('#'))
-    lines = (x for x in lines if not x.startswith(':'))
+    return list(_iter_list_lines(fn))
+
 
-    return list(lines)
+class ListFile(object):
+    """An iterable of the items of a list file; each iteration reads the
+    file lazily from the beginning, so a large list never stays in memory.
+
+    Arguments
+    ---------
+    fn (str)
+        The filename of the list file.
+    iter_items (function)
+        A function yielding items of a list file, e.g., iter_char_list.
+    """
+    def __init__(self, fn, iter_items):
+        open(fn, 'rb').close()      # raise IOError early
+        self.fn = fn
+        self.iter_items = iter_items
+
+    def __iter__(self):
+        return self.iter_items(self.fn)
 
 #------------------------------------------------------------------------------
 
@@ -98,22 +244,138 @@ def font_max_size(font):
 
 def gen_pil_if_necessary(filename):
     """Generate PIL bitmap font if the input is a X Window bitmap font (.bdf
-    or .pcf); and return the modified (if conversion happen) filename.
+    or .pcf); and return the modified (if conversion happen) filename. The
+    PIL bitmap font (.pil and .pbm) is kept in the on-disk cache keyed by the
+    content hash of the X Window bitmap font, and reused while the font file
+    is unchanged; the directory of the font file is never written.
     """
-    f_main, f_ext = os.path.splitext(filename)
+    f_ext = os.path.splitext(filename)[1]
+    if f_ext.lower() not in ['.bdf', '.pcf']:
+        return filename
 
-    if f_ext.lower() in ['.bdf', '.pcf']:
+    def convert(base):
         with open(filename, 'rb') as f:
             try:
                 p = PcfFontFile.PcfFontFile(f)
             except SyntaxError:
                 f.seek(0)
                 p = BdfFontFile.BdfFontFile(f)
-            p.save(filename)
-            filename = f_main + '.pil'
+            p.save(base)
+
+    key = cache.file_digest(filename)
+    if key not in _pil_fonts:
+        with stats.timing('convert'):
+            base = cache.file_entry('pilfont', key, ['.pbm', '.pil'], convert)
+        _pil_fonts[key] = base + '.pil'
+    return _pil_fonts[key]
+
+_pil_fonts = {}     # content hash of a X Window font -> PIL font filename
+
+
+def font_size_table(filename):
+    """Return a dict mapping point sizes of a TrueType/OpenType font file to
+    their maxima (width, height). The dict is loaded from (and kept in sync
+    with) the on-disk cache keyed by the content hash of the font file. A
+    font found only by name in system font directories (e.g., "arial.ttf")
+    is cached in memory only.
+    """
+    key = _font_key(filename)
+    if key not in _size_tables:
+        entry = cache.load('metrics', key) if key != filename else None
+        _size_tables[key] = dict((int(k), tuple(v))
+                                 for k, v in (entry or {}).items())
+    return _size_tables[key]
+
+_size_tables = {}
+
+
+def _font_key(filename):
+    """Return the content hash of a font file, or the given name if it is not
+    a path of an existing file.
+    """
+    if os.path.isfile(filename):
+        return cache.file_digest(filename)
     return filename
 
 
+def search_font_size(filename, height, lo=MIN_FONT_SIZE):
+    """Return a (point size, (max width, max height)) pair of the largest
+    point size whose max height fits in *height*, or MIN_FONT_SIZE if none
+    fits. The search bisects sizes in [lo, height*3/2] since the max height
+    of a font grows monotonically with its point size; *lo* is a size known
+    to fit, e.g., the result of a smaller height.
+    """
+    table = font_size_table(filename)
+    n_table = len(table)
+
+    def measure(size):
+        if size not in table:
+            table[size] = font_max_size(ImageFont.truetype(filename, size))
+        return table[size]
+
+    hi = max(height*3/2, lo)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if measure(mid)[1] <= height:
+            lo = mid
+        else:
+            hi = mid - 1
+    wh = measure(lo)
+
+    key = _font_key(filename)
+    if len(table) != n_table and key != filename:
+        cache.save('metrics', key, dict((str(k), v) for k, v in table.items()))
+    return lo, wh
+
+
+@stats.timed('load_font')
+def load_font(filename, size):
+    """Load a font with a resolved (filename, size) pair from resolve_font().
+    The *size* is None for a PIL bitmap font. The filename of a TrueType font
+    can also be a file object (see FontPool).
+    """
+    if size is None:
+        return ImageFont.load(filename)
+    return ImageFont.truetype(filename, size)
+
+
+def resolve_font(filename, height):
+    """
+    Return an (actual height, filename, size) tuple of the font to load with
+    load_font(). The returned filename differs from the given one if a X
+    Window bitmap font was converted into a PIL bitmap font; the size is None
+    for a PIL bitmap font.
+
+    Arguments
+    ---------
+    filename (str)
+        The font filename (see select_font).
+    height (int)
+        the upper bound of height of the givent font
+    """
+    return resolve_fonts(filename, [height])[0]
+
+
+@stats.timed('select_font')
+def resolve_fonts(filename, heights):
+    """Return a list of (actual height, filename, size) tuples of a font
+    for several upper bounds of height (see resolve_font). The font is
+    converted once, and the search of each height starts from the size of
+    the smaller one with the size table shared.
+    """
+    filename = gen_pil_if_necessary(filename)
+    if filename.lower().endswith('.pil'):
+        _w, h = font_max_size(ImageFont.load(filename))
+        return [(h, filename, None)] * len(heights)
+    resolved = {}
+    size = MIN_FONT_SIZE
+    for height in sorted(set(heights)):
+        size, (_w, h) = search_font_size(filename, height, size)
+        resolved[height] = (h, filename, size)
+    #print "[INF] Font:{}; size:{}".format(filename, size)
+    return [resolved[x] for x in heights]
+
+
 def select_font(filename, height):
     """
     Return an (actual height, font) pair with given truetype font file (or PIL
@@ -128,20 +390,147 @@ def select_font(filename, height):
     height (int)
         the upper bound of height of the givent font
     """
-    filename = gen_pil_if_necessary(filename)
-    if filename.lower().endswith('.pil'):
-        font = ImageFont.load(filename)
-        _w, h = font_max_size(font)
-    else:
-        for i in xrange(height*3/2, MIN_FONT_SIZE-1, -1):
-            font = ImageFont.truetype(filename, i)
-            _w, h = font_max_size(font)
-            if h <= height:
-                break
-    #print "[INF] Font:{}; size:{}".format(filename, i)
+    h, filename, size = resolve_font(filename, height)
     #ascent, descent = font.getmetrics()
     #(width, baseline), (offset_x, offset_y) = font.font.getsize(text)
-    return h, font
+    return h, load_font(filename, size)
+
+
+def font_coverage(filename, font=None):
+    """Return sorted [first, last] ranges of codepoints a resolved font
+    covers (see fontcover.font_ranges), or None if the font file is unknown,
+    i.e., no file is found even as the path of the loaded *font*.
+    """
+    if not os.path.isfile(filename):
+        filename = getattr(font, 'path', None)
+        if not (isinstance(filename, basestring) and
+                os.path.isfile(filename)):
+            return None
+    return fontcover.font_ranges(filename)
+
+
+class FontPool(object):
+    """A pool of loaded fonts keyed by (filename, size) and of resolved fonts
+    keyed by (filename, height), so building pictures of the same font many
+    times in a process neither converts nor loads the font again.
+
+    Arguments
+    ---------
+    max_fonts (int)
+        The number of loaded fonts to keep; the least recently used font is
+        dropped beyond it.
+    """
+    def __init__(self, max_fonts=16):
+        self.max_fonts = max_fonts
+        self.fonts = OrderedDict()
+        self.resolved = {}
+        self.data = {}      # filename -> content of a TrueType font file
+        self.hits = self.misses = 0
+
+    def resolve(self, filename, height):
+        """The pooled version of resolve_font().
+        """
+        return self.resolve_all(filename, [height])[0]
+
+    def resolve_all(self, filename, heights):
+        """The pooled version of resolve_fonts().
+        """
+        missing = [x for x in heights if (filename, x) not in self.resolved]
+        if missing:
+            for height, resolved in zip(missing,
+                                        resolve_fonts(filename, missing)):
+                self.resolved[(filename, height)] = resolved
+        return [self.resolved[(filename, x)] for x in heights]
+
+    def load(self, filename, size):
+        """The pooled version of load_font(). A TrueType font file is read
+        once and shared by the loaded fonts of its sizes.
+        """
+        key = (filename, size)
+        font = self.fonts.pop(key, None)
+        if font is None:
+            self.misses += 1
+            font = load_font(self._source(filename, size), size)
+        else:
+            self.hits += 1
+        self.fonts[key] = font
+        while len(self.fonts) > self.max_fonts:
+            (fn, _size), _font = self.fonts.popitem(last=False)
+            if not any(x[0] == fn for x in self.fonts):
+                self.data.pop(fn, None)
+        return font
+
+    def _source(self, filename, size):
+        """Return a file object reading the shared content of a TrueType
+        font file, or the filename of another font, e.g., a font found by
+        name in system font directories.
+        """
+        if size is None or not os.path.isfile(filename):
+            return filename
+        if filename not in self.data:
+            with open(filename, 'rb') as f:
+                self.data[filename] = f.read()
+        return _SharedFile(self.data[filename])
+
+    def select(self, filename, height):
+        """The pooled version of select_font().
+        """
+        h, filename, size = self.resolve(filename, height)
+        return h, self.load(filename, size)
+
+_font_pool = FontPool()
+
+
+class _SharedFile(object):
+    """A file object whose read() returns shared bytes without a copy; PIL
+    keeps the bytes of a font read from a file object.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FontChain(object):
+    """Fonts of a fallback chain: a character is drawn with the first font
+    covering it. A character no font covers is drawn as a missing glyph of
+    the first font, or of the first TrueType/OpenType font beyond U+00FF
+    since a PIL bitmap font cannot draw it. Pictures of the fixed height
+    take the maxima height of all fonts, so characters of different fonts
+    line up.
+
+    Arguments
+    ---------
+    fonts ((str, int)...)
+        List resolved (filename, size) pairs of fonts in the order of
+        preference (see resolve_font); fonts resolved with the same upper
+        bound of height are drawn in consistent sizes.
+    pool (FontPool)
+        The pool to load fonts; None to load them without a pool.
+    """
+    def __init__(self, fonts, pool=None):
+        load = pool.load if pool else load_font
+        self.fonts = [load(fn, size) for fn, size in fonts]
+        self.index = fontcover.Index([font_coverage(fn, font) for (fn, _size),
+                                      font in zip(fonts, self.fonts)])
+        self.height = max(font.getsize('g')[1] for font in self.fonts)
+        self.missing = next((i for i, (_fn, size) in enumerate(fonts)
+                             if size is not None), 0)
+
+    def index_of(self, ch):
+        """Return the index of the font drawing a character.
+        """
+        cp = fontcover.codepoint(ch)
+        i = self.index.lookup(cp)
+        if i is None:
+            return self.missing if cp > 0xFF else 0
+        return i
+
+    def select(self, ch):
+        """Return the font drawing a character.
+        """
+        return self.fonts[self.index_of(ch)]
 
 #------------------------------------------------------------------------------
 
@@ -167,24 +556,28 @@ def sym_name(char):
     return name_from_char.get(char, char)
 
 
-def filename_from_chars(chars):
+def filename_from_char(ch):
     low_if_low = lambda x: 'LOW_' + x if len(x)==1 and x.islower() else x
     upp_if_upp = lambda x: 'UPP_' + x if len(x)==1 and x.isupper() else x
     num_if_num = lambda x: 'NUM_' + x if len(x)==1 and x.isdigit() else x
     sym_if_sym = lambda x: 'SYM_' + sym_name(x) if len(x)==1 else x
 
     # apply name mangling
-    chars = [low_if_low(x) for x in chars]
-    chars = [upp_if_upp(x) for x in chars]
-    chars = [num_if_num(x) for x in chars]
-    chars = [sym_if_sym(x) for x in chars]
-    return ['CH_'+x for x in chars]
+    ch = low_if_low(ch)
+    ch = upp_if_upp(ch)
+    ch = num_if_num(ch)
+    ch = sym_if_sym(ch)
+    return 'CH_' + ch
+
+
+def filename_from_chars(chars):
+    return [filename_from_char(x) for x in chars]
 
 #------------------------------------------------------------------------------
 # Picture Generaors
 #------------------------------------------------------------------------------
 
-def gen_fore_pics(chars, filenames, font, color, fixed_height):
+def gen_fore_pics(chars, filenames, font, color, fixed_height, bits=None):
     """Generate pictures drawing given characters.
 
     Arguments
@@ -199,23 +592,42 @@ def gen_fore_pics(chars, filenames, font, color, fixed_height):
         The color of drawing characters.
     fixed_height (bool)
         Decide if use the maxima height to draw the character.
+    bits (int)
+        The bit depth (1, 2, 4, or 8) of paletted pictures without
+        anti-aliasing; None for RGBA pictures with anti-aliasing.
+    """
+    fixed_height = _fixed_height(font, fixed_height)
+    for batch in chunks(izip(chars, filenames), BATCH_SIZE):
+        stats.count('glyphs', len(batch))
+        ims = _gen_fore_pics([ch for ch, _fn in batch], font, color,
+                             fixed_height, bits)
+        for im, (_ch, fn) in zip(ims, batch):
+            _save_pic(im, fn, bits)
+
+
+def _gen_fore_pic(ch, font, fg_color, fixed_height, bits=None):
+    """Generate a RGBA image drawing a given character with anti-aliasing, or
+    a paletted image without anti-aliasing if the *bits* is given.
     """
-    def gen_ch_pic(ch, font, fg_color):
+    if bits:
+        im = _gen_ch_pic(ch, font, 0, 255, fixed_height)
+        im = im.point(_MONO_INDEX_LUT).convert('P')
+        im.putpalette([0, 0, 0] + list(fg_color[:3]))
+        return im
+
+    with stats.timing('draw'):
         ch_w, ch_h = font.getsize(ch)
         if fixed_height:
-            _w, ch_h = font.getsize('g')     # get the max height of the font
+            ch_h = _fixed_height(font, fixed_height)
         size = (ch_w, ch_h)
         canvas = Image.new('RGBA', size)
         draw = ImageDraw.Draw(canvas)
         draw.text((0,0), ch, font=font, fill=fg_color)
         del draw
-        return canvas
-
-    for ch, fn in zip(chars, filenames):
-        im = gen_ch_pic(ch, font, color)
-        im.save(fn)
+    return canvas
 
 
+@stats.timed('draw')
 def _gen_ch_pic(ch, font, fg_level, bg_level, fixed_height=True):
     """Generate an image drawing a given character.
 
@@ -229,12 +641,13 @@ def _gen_ch_pic(ch, font, fg_level, bg_level, fixed_height=True):
         the level for foregournd color.
     bg_level (0..255)
         the level of background color
-    fixed_height (bool)
-        Decide if use the maxima height to draw the character.
+    fixed_height (bool or int)
+        Decide if use the maxima height to draw the character; a number of
+        pixels assigns the height, e.g., the height of a FontChain.
     """
     ch_w, ch_h = font.getsize(ch)
     if fixed_height:
-        _w, ch_h = font.getsize('g')     # get the max height of the font
+        ch_h = _fixed_height(font, fixed_height)
     size = (ch_w, ch_h)
     im = Image.new('1', size, color=1)
     draw = ImageDraw.Draw(im)
@@ -248,57 +661,1158 @@ def _gen_ch_pic(ch, font, fg_level, bg_level, fixed_height=True):
     return im
 
 
-def _apply_color(im, fg_color, ol_color, bg_color):
-    """Put a palette for an image with given colors.
+def _gen_ch_pics(chars, font, fg_level, bg_level, fixed_height=True):
+    """The batched version of _gen_ch_pic(): characters are drawn onto
+    shared canvases (see _draw_chars) and sliced out, which gives the same
+    pictures without the cost of several images per character.
     """
-    # using Image.ADAPTIVE to avoid dithering
-    im = im.convert('P', palette=Image.ADAPTIVE, colors=3)
+    lut = [fg_level if x == 0 else bg_level for x in range(256)]
+    ims = []
+    with stats.timing('draw', len(chars)):
+        for canvas, boxes in _draw_chars(chars, font, '1', 1, None,
+                                         fixed_height):
+            canvas = canvas.convert('L').point(lut)
+            ims += [canvas.crop(x) for x in boxes]
+    return ims
+
+
+def _gen_fore_pics(chars, font, fg_color, fixed_height, bits=None):
+    """The batched version of _gen_fore_pic() (see _gen_ch_pics).
+    """
+    if bits:
+        ims = []
+        for im in _gen_ch_pics(chars, font, 0, 255, fixed_height):
+            im = im.point(_MONO_INDEX_LUT).convert('P')
+            im.putpalette([0, 0, 0] + list(fg_color[:3]))
+            ims.append(im)
+        return ims
+
+    ims = []
+    with stats.timing('draw', len(chars)):
+        for canvas, boxes in _draw_chars(chars, font, 'RGBA', 0, fg_color,
+                                         fixed_height):
+            ims += [canvas.crop(x) for x in boxes]
+    return ims
+
+
+# The max width of a canvas shared by the drawings of characters
+STRIP_WIDTH = 4096
+
+
+def _draw_chars(chars, font, mode, color, fill, fixed_height):
+    """Draw characters side by side onto canvases (strips) of a *mode* and
+    a background *color* with the *fill* (None for the default ink of the
+    mode), and return a list of (canvas, boxes) pairs of the strips. A box
+    tells where a character is in its strip as drawn at (0, 0) of its own
+    canvas (see _gen_ch_pic). Characters are set apart by the ink beyond
+    their boxes, so the ink of a character never falls into the box of
+    another one, and is cut off by slicing as by the edges of its own
+    canvas.
+    """
+    if fixed_height:
+        fixed_height = _fixed_height(font, fixed_height)
+    cells = []
+    for ch in chars:
+        (w, h), (left, top, right, bottom) = _char_extent(font, ch)
+        if fixed_height:
+            h = fixed_height
+        cells.append((ch, w, h, min(left, 0), min(top, 0), max(right, w),
+                      max(bottom, h)))
+
+    strips = [[]]
+    width = 0
+    for cell in cells:
+        span = cell[5] - cell[3]
+        if strips[-1] and width + span > STRIP_WIDTH:
+            strips.append([])
+            width = 0
+        strips[-1].append(cell)
+        width += span
+
+    results = []
+    for strip in strips:
+        if not strip:
+            continue
+        y = -min(x[4] for x in strip)
+        size = (sum(x[5] - x[3] for x in strip),
+                y + max(x[6] for x in strip))
+        canvas = Image.new(mode, size, color)
+        draw = ImageDraw.Draw(canvas)
+        boxes = []
+        x = 0
+        for ch, w, h, left, _top, right, _bottom in strip:
+            x -= left
+            draw.text((x, y), ch, font=font, fill=fill)
+            boxes.append((x, y, x + w, y + h))
+            x += right
+        del draw
+        results.append((canvas, boxes))
+    return results
+
+
+def _char_extent(font, ch):
+    """Return the size of a character (as font.getsize) and the (left, top,
+    right, bottom) box of the mask drawing it at (0, 0). The mask of a
+    TrueType font is offset from the origin, and its size plus the offset is
+    the size of the character, so one measurement tells both.
+    """
+    if isinstance(font, ImageFont.FreeTypeFont):
+        (w, h), (x, y) = font.font.getsize(ch)
+        return (x + w, y + h), (x, y, x + w, y + h)
+    w, h = font.getsize(ch)
+    return (w, h), (0, 0, w, h)
+
+
+def _fixed_height(font, fixed_height):
+    """Return the height of pictures of the fixed height (see _gen_ch_pic):
+    the maxima height of a font or a FontChain if *fixed_height* is True, or
+    else *fixed_height* as is. Generators call it once per font rather than
+    once per character.
+    """
+    if not isinstance(fixed_height, bool) or not fixed_height:
+        return fixed_height
+    if isinstance(font, FontChain):
+        return font.height
+    _w, h = font.getsize('g')     # get the max height of the font
+    return h
 
-    # Index begins from maximal color value down to minimal color value
+
+# Palette indices of the levels 255 (background), 128 (outline/shadow), and
+# 0 (foreground) of a decorated picture
+_INDEX_LUT = [0 if x > 191 else 1 if x > 63 else 2 for x in range(256)]
+
+# Palette indices of the levels 255 (background) and 0 (foreground)
+_MONO_INDEX_LUT = [0 if x > 127 else 1 for x in range(256)]
+
+
+@stats.timed('color')
+def _apply_color(im, fg_color, ol_color, bg_color):
+    """Put a palette for an image with given colors. The background, outline,
+    and foreground levels map directly to palette indices 0, 1, and 2.
+    """
+    im = im.point(_INDEX_LUT).convert('P')
     im.putpalette(list(bg_color) + list(ol_color) + list(fg_color))
     return im
 
 
+def _save_pic(im, fn, bits=None):
+    """Save a picture; the background (index 0) of a paletted picture is
+    transparent. The *bits* assigns the bit depth of a paletted picture.
+    In a writer.writing() block, the picture is saved by a writer thread.
+    """
+    writer.save(_write_pic, im, fn, bits)
+
+
+@stats.timed('save')
+def _write_pic(im, fn, bits=None):
+    im.save(fn, **_png_options(im, bits))
+
+    if stats.enabled():
+        stats.count('pictures')
+        stats.count('bytes', os.path.getsize(fn))
+
+
+def _png_options(im, bits=None):
+    """Return the keyword arguments of saving a picture (see _save_pic).
+    """
+    kwargs = writer.png_options()
+    if im.mode == 'P':
+        kwargs['transparency'] = 0
+        if bits:
+            if len(im.palette.getdata()[1]) // 3 > 1 << bits:
+                raise ValueError('Paletted pictures of {} colors cannot be '
+                                 'saved in {} bit(s).'.format(
+                                 len(im.palette.getdata()[1]) // 3, bits))
+            kwargs['bits'] = bits
+    return kwargs
+
+
+def encode_pic(im, bits=None):
+    """Return the PNG bytes of a picture as _save_pic saves it.
+    """
+    f = io.BytesIO()
+    im.save(f, 'PNG', **_png_options(im, bits))
+    return f.getvalue()
+
+
+def _ink_bbox(im):
+    """Return the bounding box of the ink of a picture, i.e., of the pixels
+    other than the transparent or background ones (index 0), or None.
+    """
+    if im.mode == 'RGBA':
+        return im.getchannel('A').getbbox()
+    return im.getbbox()
+
+
+@stats.timed('crop')
+def crop_pics(ims):
+    """Crop pictures of a character to the union of their ink bounding
+    boxes, so pictures of several effects still line up. Return a list of
+    cropped pictures and the (left, top, right, bottom) box in the pictures;
+    pictures without ink keep their top-left pixel.
+    """
+    boxes = [x for x in (_ink_bbox(im) for im in ims) if x]
+    if not boxes:
+        box = (0, 0, 1, 1)
+    else:
+        box = (min(x[0] for x in boxes), min(x[1] for x in boxes),
+               max(x[2] for x in boxes), max(x[3] for x in boxes))
+    return [im.crop(box) for im in ims], box
+
+
+def font_ascent(font):
+    """Return the (ascent, descent) of a TrueType/OpenType font; the
+    baseline of a character drawn at (0, 0) is at the ascent. Return (None,
+    None) for a PIL bitmap font, which keeps no baseline.
+    """
+    if hasattr(font, 'getmetrics'):
+        return font.getmetrics()
+    return None, None
+
+
 def gen_outline_pics(chars, filenames, font,
-                  fg_color, ol_color, bg_color, fixed_height):
+                  fg_color, ol_color, bg_color, fixed_height, bits=None):
     """Genarate a character image with a generated outline.
     """
     fg_level, ol_level, bg_level = 0, 128, 255
-    for ch, fn in zip(chars, filenames):
+    fixed_height = _fixed_height(font, fixed_height)
+    for ch, fn in izip(chars, filenames):
+        stats.count('glyphs')
         im = _gen_ch_pic(ch, font, fg_level, bg_level, fixed_height)
-        im = decor.add_outline(im, fg_level, ol_level, bg_level)
+        with stats.timing('decor'):
+            im = decor.add_outline(im, fg_level, ol_level, bg_level)
         im = _apply_color(im, fg_color, ol_color, bg_color)
-        im.save(fn, transparency=0)
+        _save_pic(im, fn, bits)
 
 
 def gen_shadow11_pics(chars, filenames, font,
-                      fg_color, ol_color, bg_color, fixed_height):
+                      fg_color, ol_color, bg_color, fixed_height, bits=None):
     """Genarate a character image with a generated 1x1 shadow.
     """
     fg_level, ol_level, bg_level = 0, 128, 255
-    for ch, fn in zip(chars, filenames):
+    fixed_height = _fixed_height(font, fixed_height)
+    for ch, fn in izip(chars, filenames):
+        stats.count('glyphs')
         im = _gen_ch_pic(ch, font, fg_level, bg_level, fixed_height)
-        im = decor.add_shadow11(im, fg_level, ol_level, bg_level)
+        with stats.timing('decor'):
+            im = decor.add_shadow11(im, fg_level, ol_level, bg_level)
         im = _apply_color(im, fg_color, ol_color, bg_color)
-        im.save(fn, transparency=0)
+        _save_pic(im, fn, bits)
 
 
 def gen_shadow21_pics(chars, filenames, font,
-                      fg_color, ol_color, bg_color, fixed_height):
+                      fg_color, ol_color, bg_color, fixed_height, bits=None):
     """Genarate a character image with a generated 2x1 shadow.
     """
     fg_level, ol_level, bg_level = 0, 128, 255
-    for ch, fn in zip(chars, filenames):
+    fixed_height = _fixed_height(font, fixed_height)
+    for ch, fn in izip(chars, filenames):
+        stats.count('glyphs')
         im = _gen_ch_pic(ch, font, fg_level, bg_level, fixed_height)
-        im = decor.add_shadow21(im, fg_level, ol_level, bg_level)
+        with stats.timing('decor'):
+            im = decor.add_shadow21(im, fg_level, ol_level, bg_level)
         im = _apply_color(im, fg_color, ol_color, bg_color)
-        im.save(fn, transparency=0)
+        _save_pic(im, fn, bits)
+
+
+EFFECTS = ['fore', 'outline', 'shadow11', 'shadow21']
+
+DECORATORS = {
+    'outline': decor.add_outline,
+    'shadow11': decor.add_shadow11,
+    'shadow21': decor.add_shadow21,
+}
+
+
+def gen_multi_pics(chars, filenames, font, effects, fixed_height,
+                   engine='pil', bits=None):
+    """Generate pictures of several effects at once. Each character is drawn
+    only once and the drawing is decorated with every effect.
+
+    Arguments
+    ---------
+    chars (str)
+        List characters to draw.
+    filenames ((str, str...), (str, str...)...)
+        List tuples of filenames of characters; a tuple lists the filenames of
+        a character in the order of *effects*.
+    font (ImageFont or FontChain)
+        A font to draw, or a chain of fonts to draw each character with the
+        first font covering it.
+    effects ((str, ImageColor, ImageColor, ImageColor)...)
+        List (effect, fg_color, ol_color, bg_color) tuples. An effect is one
+        of EFFECTS; the ol_color and bg_color are ignored by 'fore'.
+    fixed_height (bool)
+        Decide if use the maxima height to draw the character.
+    engine (str)
+        The decoration engine, 'pil' or 'numpy'. The 'numpy' engine decorates
+        characters in batches and needs NumPy; both give the same pictures.
+    bits (int)
+        The bit depth of paletted pictures (see gen_fore_pics).
+
+    With the deduplication enabled (see dedup), the pictures of a character
+    drawn the same as an earlier one are not decorated nor saved but hard
+    links of the earlier ones.
+    """
+    fixed_height = _fixed_height(font, fixed_height)
+    for batch in chunks(izip(chars, filenames), BATCH_SIZE):
+        stats.count('glyphs', len(batch))
+        drawings = _draw_effect_pics([ch for ch, _fns in batch], font,
+                                     effects, fixed_height, bits)
+        aliases = []
+        if dedup.enabled():
+            batch, drawings, aliases = _dedup_drawings(batch, drawings)
+        pics = _decorate_drawings(drawings, effects, engine)
+        for ims, (_ch, fns) in zip(pics, batch):
+            for im, fn in zip(ims, fns):
+                _save_pic(im, fn, bits)
+        if aliases:
+            writer.flush()
+        for fns, first in aliases:
+            for src, dst in zip(first, fns):
+                dedup.link(src, dst)
+
+BATCH_SIZE = 256
+
+
+def chunks(items, size):
+    """Yield lists of *size* items (the last one may be shorter) from an
+    iterable without reading it all.
+    """
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def render_multi_pics(chars, font, effects, fixed_height, engine='pil',
+                      bits=None):
+    """Return a list of picture lists of characters; a picture list lists the
+    pictures of a character in the order of *effects* (see gen_multi_pics).
+    """
+    stats.count('glyphs', len(chars))
+    fixed_height = _fixed_height(font, fixed_height)
+    drawings = _draw_effect_pics(chars, font, effects, fixed_height, bits)
+    return _decorate_drawings(drawings, effects, engine)
+
+
+def _render_pairs(chars, *args):
+    """Return a list of (char, pictures) pairs (see render_multi_pics).
+    """
+    return zip(chars, render_multi_pics(chars, *args))
+
+
+def _render_states(chars, *args):
+    """The version of _render_pairs() for worker processes; the pictures
+    are returned as their states (see _pic_state).
+    """
+    return [(ch, [_pic_state(im) for im in ims])
+            for ch, ims in _render_pairs(chars, *args)]
+
+
+def _pic_state(im):
+    """Return a (mode, size, pixels, palette) tuple of a picture. Unlike a
+    pickled picture, it keeps the palette size of a paletted picture, which
+    decides the size of the saved PNG palette.
+    """
+    palette = None
+    if im.mode == 'P':
+        palette = im.getpalette()[:len(im.palette.getdata()[1])]
+    data = im.tobytes() if im.size[0] and im.size[1] else b''
+    return im.mode, im.size, data, palette
+
+
+def _pic_from_state(state):
+    mode, size, data, palette = state
+    im = Image.frombytes(mode, size, data) if data else Image.new(mode, size)
+    if palette:
+        im.putpalette(palette)
+    return im
+
+
+def _draw_effect_pics(chars, font, effects, fixed_height, bits=None):
+    """Return a list of drawing lists of characters; a drawing list lists
+    the drawings of a character in the order of *effects*: the picture of
+    the 'fore' effect, or the drawing to decorate with another effect; the
+    latter is drawn only once and shared. The characters of each font are
+    drawn onto shared canvases (see _gen_ch_pics). The *fixed_height* is
+    resolved by _fixed_height().
+    """
+    if isinstance(font, FontChain):
+        groups = OrderedDict()      # font index -> indices of characters
+        for i, ch in enumerate(chars):
+            groups.setdefault(font.index_of(ch), []).append(i)
+        drawings = [None] * len(chars)
+        for k, idx in groups.items():
+            ims = _draw_effect_pics([chars[i] for i in idx], font.fonts[k],
+                                    effects, fixed_height, bits)
+            for i, x in zip(idx, ims):
+                drawings[i] = x
+        return drawings
+
+    bases = None
+    columns = []
+    for effect, fg_color, _ol_color, _bg_color in effects:
+        if effect == 'fore':
+            columns.append(_gen_fore_pics(chars, font, fg_color,
+                                          fixed_height, bits))
+            continue
+        if bases is None:
+            bases = _gen_ch_pics(chars, font, 0, 255, fixed_height)
+        columns.append(bases)
+    return [list(ims) for ims in zip(*columns)]
+
+
+def _decorate_drawings(drawings, effects, engine='pil'):
+    """Return a list of picture lists decorated and colored from lists of
+    drawings of characters (see _draw_effect_pics).
+    """
+    if not drawings:
+        return []
+    if engine == 'numpy':
+        try:
+            import npdecor
+        except ImportError:
+            raise ValueError('The numpy engine requires NumPy.')
+
+    fg_level, ol_level, bg_level = 0, 128, 255
+    columns = []
+    for i, (effect, fg_color, ol_color, bg_color) in enumerate(effects):
+        ims = [x[i] for x in drawings]
+        if effect == 'fore':
+            columns.append(ims)
+            continue
+        if engine == 'numpy':
+            with stats.timing('decor', len(ims)):
+                ims = npdecor.decorate(ims, npdecor.DECORATORS[effect],
+                                       fg_level, ol_level, bg_level)
+        else:
+            decorated = []
+            for im in ims:
+                with stats.timing('decor'):
+                    decorated.append(DECORATORS[effect](im, fg_level,
+                                                        ol_level, bg_level))
+            ims = decorated
+        columns.append([_apply_color(im, fg_color, ol_color, bg_color)
+                        for im in ims])
+    return [list(ims) for ims in zip(*columns)]
+
+
+def _dedup_drawings(batch, drawings):
+    """Split (char, filenames) pairs with their drawings into the ones of
+    new drawings, and return them with (filenames, first filenames) pairs of
+    the characters drawn the same as earlier ones.
+    """
+    items, news, aliases = [], [], []
+    for item, ims in zip(batch, drawings):
+        first = dedup.add(dedup.digest(ims), item[0], item[1])
+        if first is None:
+            items.append(item)
+            news.append(ims)
+        else:
+            aliases.append((item[1], first))
+    return items, news, aliases
+
+#------------------------------------------------------------------------------
+# Parallel Generation
+#------------------------------------------------------------------------------
+
+_worker_font = None
+
+def _init_worker(font_filename, font_size, with_stats=False,
+                 with_dedup=False, writer_options=None):
+    """Load the font once per worker process; lists of filenames and sizes
+    load a FontChain.
+    """
+    global _worker_font
+    if writer_options:
+        writer.configure(**writer_options)
+    if with_stats:
+        stats.enable()
+    if with_dedup:
+        dedup.enable()
+    if isinstance(font_filename, list):
+        _worker_font = FontChain(zip(font_filename, font_size))
+    else:
+        _worker_font = load_font(font_filename, font_size)
+
+
+def _run_chunk(task):
+    """Run a function with a chunk of items in a worker process, and return
+    the result with the statistics and the deduplication records of the
+    chunk (None if disabled).
+    """
+    func, items, func_args = task
+    result = func(items, _worker_font, *func_args)
+    return result, stats.take(), dedup.take()
+
+
+def map_parallel(func, items, font_filename, font_size, func_args=(),
+                 jobs=0, chunk_size=None):
+    """Call func(chunk, font, *func_args) for chunks of *items* with a process
+    pool and return the concatenation of the returned lists in order.
+    """
+    return list(imap_parallel(func, items, font_filename, font_size,
+                              func_args, jobs, chunk_size))
+
+
+def imap_parallel(func, items, font_filename, font_size, func_args=(),
+                  jobs=0, chunk_size=None):
+    """The lazy version of map_parallel(): yield the items of the returned
+    lists in order as soon as their chunks are done.
+
+    Arguments
+    ---------
+    func (function)
+        A module-level function returning a list.
+    items (iterable)
+        Items to split into chunks; an iterable without length, e.g., a
+        generator, is read lazily in chunks of LAZY_CHUNK_SIZE by default.
+    font_filename, font_size
+        The font to load in each worker (see resolve_font), or lists of
+        filenames and sizes of a FontChain.
+    func_args (tuple)
+        The arguments of func following the font.
+    jobs (int)
+        The number of worker processes; 0 denotes the number of CPUs.
+    chunk_size (int)
+        The number of items per task; None for an automatic size.
+    """
+    from multiprocessing import Pool, cpu_count
+
+    jobs = jobs or cpu_count()
+    if chunk_size is None:
+        if hasattr(items, '__len__'):
+            chunk_size = max(1, min(256, len(items) // (jobs * 4)))
+        else:
+            chunk_size = LAZY_CHUNK_SIZE
+
+    # chunks are read in this process, at most 2 pending tasks per worker
+    pool = Pool(jobs, _init_worker,
+                (font_filename, font_size, stats.enabled(), dedup.enabled(),
+                 writer.options()))
+    try:
+        pending = deque()
+
+        def collect():
+            result, data, records = pending.popleft().get()
+            stats.merge(data)
+            dedup.merge(records)
+            return result
+
+        for chunk in chunks(items, chunk_size):
+            task = (func, chunk, tuple(func_args))
+            pending.append(pool.apply_async(_run_chunk, (task,)))
+            if len(pending) >= jobs * 2:
+                for x in collect():
+                    yield x
+        while pending:
+            for x in collect():
+                yield x
+        pool.close()
+    except GeneratorExit:
+        # the caller stopped early; a terminate() with busy workers may hang
+        for result in pending:
+            result.wait()
+        pool.close()
+        raise
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+LAZY_CHUNK_SIZE = 64
+
+
+def _gen_each(items, font, gen_pics, *gen_args):
+    """Generate pictures of (char, filename) pairs, and return a list of
+    (filename, error message) pairs of failed characters. A chunk failed as a
+    whole is generated again one by one to find the failed characters.
+    """
+    chars, filenames = [x[0] for x in items], [x[1] for x in items]
+    try:
+        with writer.writing():
+            gen_pics(chars, filenames, font, *gen_args)
+        return []
+    except Exception:
+        pass
+
+    errors = []
+    for ch, fn in items:
+        try:
+            with writer.writing():
+                gen_pics([ch], [fn], font, *gen_args)
+        except Exception as err:
+            errors.append((fn, u'{}: {}'.format(type(err).__name__, err)))
+    return errors
+
+
+def gen_pics_parallel(gen_pics, chars, filenames, font_filename, font_size,
+                      gen_args, jobs=0, chunk_size=None):
+    """Generate pictures with a process pool and return a list of (filename,
+    error message) pairs of characters failed to generate. The output is the
+    same as calling gen_pics(chars, filenames, font, *gen_args) serially.
+
+    Arguments
+    ---------
+    gen_pics (function)
+        A picture generator, e.g., gen_outline_pics.
+    chars (str)
+        List characters to draw.
+    filenames (str, str...)
+        List filenames of characters.
+    font_filename, font_size
+        The font to load in each worker (see map_parallel).
+    gen_args (tuple)
+        The arguments of gen_pics following the font.
+    jobs (int)
+        The number of worker processes; 0 denotes the number of CPUs.
+    chunk_size (int)
+        The number of characters per task; None for an automatic size.
+    """
+    gen_args = (gen_pics,) + tuple(gen_args)
+    return map_parallel(_gen_each, izip(chars, filenames),
+                        font_filename, font_size, gen_args, jobs, chunk_size)
+
+#------------------------------------------------------------------------------
+# Renderer
+#------------------------------------------------------------------------------
+
+class Renderer(object):
+    """A font and effects to render pictures of characters in memory, or to
+    save them as files. The commands of the command line are built on it.
+
+    Arguments
+    ---------
+    font (str or [str...])
+        The font filename (see select_font), or a list of filenames of a
+        fallback chain; each character is drawn with the first font
+        covering it (see FontChain).
+    size (int)
+        The upper bound of height of the fonts.
+    effects ((str, ImageColor, ImageColor, ImageColor)...)
+        List effects; an effect is an (effect, fg_color, ol_color, bg_color)
+        tuple (see gen_multi_pics) or just a name of EFFECTS drawn in the
+        default colors, i.e., white, gray, and black.
+    fixed_height (bool)
+        Decide if use the maxima height to draw characters.
+    engine (str)
+        The decoration engine, 'pil' or 'numpy' (see gen_multi_pics).
+    bits (int)
+        The bit depth of paletted pictures (see gen_fore_pics).
+    jobs (int)
+        The number of processes to render pictures; 0 denotes the number of
+        CPUs.
+    pool (FontPool)
+        The pool to load the font; None for the pool of this process.
+    tight (bool)
+        Crop the pictures of each character to their ink bounding box (see
+        crop_pics); the metrics tell where the box is in the character.
+
+    Example
+    -------
+    >>> r = Renderer('arial.ttf', 24, ['outline', ('fore', (255,0,0), 0, 0)])
+    >>> for ch, (outline, fore), metrics in r.render(u'Ag'):
+    ...     print ch, outline.mode, fore.mode, metrics['height'] <= r.height
+    A P RGBA True
+    g P RGBA True
+    """
+    def __init__(self, font, size, effects=('fore',), fixed_height=False,
+                 engine='pil', bits=None, jobs=1, pool=None, tight=False):
+        colors = tuple(ImageColor.getrgb(x) for x in ('white', 'gray',
+                                                       'black'))
+        self.effects = [(x,) + colors if isinstance(x, basestring)
+                        else tuple(x) for x in effects]
+        for effect in self.effects:
+            if effect[0] not in EFFECTS:
+                raise ValueError('Unknown effect: {}'.format(effect[0]))
+        if bits == 1 and any(x[0] != 'fore' for x in self.effects):
+            raise ValueError('Decorated pictures of 3 colors cannot be saved '
+                             'in 1 bit.')
+        self.fixed_height, self.tight = fixed_height, tight
+        self.engine, self.bits, self.jobs = engine, bits, jobs
+        self.pool = pool or _font_pool
+        filenames = [font] if isinstance(font, basestring) else list(font)
+        resolved = [self.pool.resolve(x, size) for x in filenames]
+        self.size = size
+        self.height, self.font_filename, self.font_size = resolved[0]
+        self.fonts = [(fn, font_size) for _h, fn, font_size in resolved]
+        self._chain = None
+
+    @property
+    def chain(self):
+        """The FontChain of the fonts; it is loaded at the first use.
+        """
+        if self._chain is None:
+            self._chain = FontChain(self.fonts, self.pool)
+        return self._chain
+
+    @property
+    def font(self):
+        """The loaded font, or the FontChain of several fonts.
+        """
+        if len(self.fonts) > 1:
+            return self.chain
+        return self.pool.load(self.font_filename, self.font_size)
+
+    def _fonts(self):
+        """Return the (filename, size) of the font to load in a worker, or
+        lists of them of several fonts (see map_parallel).
+        """
+        if len(self.fonts) > 1:
+            return [list(x) for x in zip(*self.fonts)]
+        return [self.font_filename, self.font_size]
+
+    def _args(self):
+        return self.effects, self.fixed_height, self.engine, self.bits
+
+    def uncovered(self, chars):
+        """Return a list of distinct characters no font covers in order;
+        they are drawn as missing glyphs of the first font.
+        """
+        return self.chain.index.uncovered(chars)
+
+    def metrics(self, ch, ims, box=None):
+        """Return a dict of metrics of a character with its pictures. With
+        the *box* of cropped pictures (see crop_pics), the metrics also tell
+        the bearing_x (from the pen position to the left of the box),
+        bearing_y (from the baseline up to the top of the box; None for a
+        PIL bitmap font), and offset_y (from the top of the line down to the
+        top of the box).
+        """
+        font = self.font
+        if isinstance(font, FontChain):
+            font = font.select(ch)
+        w, h = ims[0].size
+        metrics = {'width': w, 'height': h, 'advance': font.getsize(ch)[0],
+                   'font_height': self.height}
+        if box is not None:
+            ascent, _descent = font_ascent(font)
+            metrics.update(bearing_x=box[0], offset_y=box[1],
+                           bearing_y=None if ascent is None
+                                     else ascent - box[1])
+        return metrics
+
+    def font_metrics(self):
+        """Return a dict of metrics of the first font: the upper bound of
+        height, the ascent and descent (see font_ascent), and the height of
+        a line (the fixed height, or None without it).
+        """
+        font = self.font
+        ascent, descent = font_ascent(font.fonts[0]
+                                      if isinstance(font, FontChain)
+                                      else font)
+        return {'font_height': self.height, 'ascent': ascent,
+                'descent': descent,
+                'line_height': _fixed_height(font, self.fixed_height) or None}
+
+    def render(self, chars):
+        """Yield a (char, pictures, metrics) tuple of each character lazily;
+        the pictures list PIL images in the order of effects.
+        """
+        if self.jobs == 1:
+            pics = (x for batch in chunks(chars, BATCH_SIZE)
+                    for x in _render_pairs(batch, self.font, *self._args()))
+        else:
+            font_filename, font_size = self._fonts()
+            states = imap_parallel(_render_states, chars, font_filename,
+                                   font_size, self._args(), self.jobs)
+            pics = ((ch, [_pic_from_state(x) for x in ims])
+                    for ch, ims in states)
+        for ch, ims in pics:
+            if self.tight:
+                ims, box = crop_pics(ims)
+                yield ch, ims, self.metrics(ch, ims, box)
+            else:
+                yield ch, ims, self.metrics(ch, ims)
+
+    def encode(self, chars):
+        """Yield a (char, PNG bytes list, metrics) tuple of each character
+        lazily (see render).
+        """
+        for ch, ims, metrics in self.render(chars):
+            yield ch, [encode_pic(im, self.bits) for im in ims], metrics
+
+    def save(self, chars, filenames):
+        """Save pictures of characters; a tuple of *filenames* lists the
+        filenames of a character in the order of effects. Return a list of
+        (filenames, error message) pairs of characters failed to generate
+        with processes; a serial run raises the error instead. The pictures
+        of a tight renderer are rendered (see render) and saved in this
+        process, and errors are raised.
+        """
+        if self.tight:
+            with writer.writing():
+                for (_ch, ims, _metrics), fns in izip(self.render(chars),
+                                                      filenames):
+                    for im, fn in zip(ims, fns):
+                        _save_pic(im, fn, self.bits)
+            return []
+        if self.jobs == 1:
+            with writer.writing():
+                gen_multi_pics(chars, filenames, self.font, *self._args())
+            return []
+        font_filename, font_size = self._fonts()
+        return gen_pics_parallel(gen_multi_pics, chars, filenames,
+                                 font_filename, font_size, self._args(),
+                                 self.jobs)
+
+# The metrics table of a tight Renderer in each directory, and the keys of the
+# metrics of a character in it
+METRICS_NAME = 'metrics.json'
+METRICS_KEYS = ['advance', 'bearing_x', 'bearing_y', 'offset_y', 'width',
+                'height']
+
+#------------------------------------------------------------------------------
+# Batch Jobs
+#------------------------------------------------------------------------------
+
+def load_job_file(fn):
+    """Return a list of jobs of a JSON, YAML (.yaml, .yml), or TOML (.toml)
+    job file. A job file holds a list "jobs" of jobs and an optional mapping
+    "defaults" of options shared by every job.
+
+    A job maps "command" to a command (e.g., "outline"), "chars" to a char
+    list file, and long option names to their values, e.g., {"command":
+    "fore", "chars": "char.lst", "font": "arial.ttf", "size": 24, "fixed":
+    true}. A switch takes a boolean, and a repeatable option, e.g., "effect"
+    of the all command, can take a list.
+    """
+    ext = os.path.splitext(fn)[1].lower()
+    with open(fn, 'rb') as f:
+        text = f.read().decode('utf_8_sig')
+
+    if ext in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('YAML job files require PyYAML.')
+        data = yaml.safe_load(text)
+    elif ext == '.toml':
+        try:
+            import toml
+        except ImportError:
+            raise ValueError('TOML job files require the toml package.')
+        data = toml.loads(text)
+    else:
+        data = json.loads(text)
+
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list):
+        raise ValueError('{}: no list of jobs'.format(fn))
+    jobs = []
+    for job in data['jobs']:
+        merged = dict(data.get('defaults') or {})
+        merged.update(job)
+        jobs.append(merged)
+    return jobs
+
+
+def job_argv(job):
+    """Return the command line arguments of a job (see load_job_file).
+    """
+    job = dict(job)
+    try:
+        argv = [job.pop('command')]
+        chars = job.pop('chars')
+    except KeyError as err:
+        raise ValueError('{} is missing in job {}'.format(err, job))
+    if job.get('archive') == '-':
+        raise ValueError('A job cannot stream an archive to the standard '
+                         'output; name an archive file in job {}'.format(job))
+
+    for key, value in sorted(job.items()):
+        opt = '--' + key.replace('_', '-')
+        if value is True:
+            argv.append(opt)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            for x in value:
+                argv += [opt, unicode(x)]
+        else:
+            argv += [opt, unicode(value)]
+    return argv + [chars]
+
+
+def _run_job(task):
+    """Run a job of (index, argv, jobs) and return a summary of the job
+    with the counts of the run (see stats.report): glyphs drawn, pictures
+    saved, and bytes written. Fonts are kept in the pool of this process
+    across jobs.
+    """
+    index, argv, jobs = task
+    summary = {'job': index, 'args': argv, 'glyphs': 0, 'pictures': 0,
+               'bytes': 0, 'error': None}
+    start = time.time()
+    try:
+        args = make_parser().parse_args(argv)
+        if jobs != 1:
+            args.jobs = 1   # a job in a worker process runs serially
+        counting = not args.stats   # or else run_args() collects them
+        if counting:
+            stats.enable()
+        try:
+            report = run_args(args) or stats.report()
+        finally:
+            if counting:
+                stats.disable()
+        summary['glyphs'] = report['glyphs']
+        summary['pictures'] = report['pictures']
+        summary['bytes'] = report['bytes_written']
+    except (IOError, ValueError) as err:
+        summary['error'] = u'{}'.format(err)
+    except Exception as err:
+        # a failed job never stops the other jobs
+        summary['error'] = u'{}: {}'.format(type(err).__name__, err)
+    summary['seconds'] = round(time.time() - start, 3)
+    return summary
+
+
+def run_jobs(argvs, jobs=0):
+    """Run jobs of command line arguments with a process pool and return
+    their summaries in order.
+
+    Arguments
+    ---------
+    argvs ([str...]...)
+        List command line arguments of jobs (see job_argv).
+    jobs (int)
+        The number of worker processes; 0 denotes the number of CPUs, and 1
+        runs jobs in this process one by one.
+    """
+    tasks = [(i, argv, jobs) for i, argv in enumerate(argvs)]
+    if jobs == 1:
+        return [_run_job(task) for task in tasks]
+
+    from multiprocessing import Pool, cpu_count
+
+    def font_of(argv):
+        opts = dict(zip(argv, argv[1:]))
+        return opts.get('--font', ''), opts.get('--size', '')
+
+    # neighboring jobs of the same font are likely to share a worker's pool
+    tasks.sort(key=lambda task: font_of(task[1]))
+    pool = Pool(jobs or cpu_count())
+    try:
+        summaries = list(pool.imap_unordered(_run_job, tasks))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return sorted(summaries, key=lambda x: x['job'])
+
+#------------------------------------------------------------------------------
+# Render Server
+#------------------------------------------------------------------------------
+
+class GlyphService(object):
+    """Render pictures of characters on demand for the serve command, with
+    LRU caches of loaded fonts and of rendered pictures (see server).
+
+    Requests
+    --------
+    GET /glyph?chars=<text>
+        Return pictures of characters. Optional parameters are font, size
+        (MIN_FONT_SIZE to MAX_FONT_SIZE), effect (one of EFFECTS), fore,
+        outline, back (colors), fixed (1 for the maxima height), bits (see
+        gen_fore_pics), and format:
+        png (default)
+            A PNG picture of one character.
+        raw
+            Concatenated pixels of pictures; the X-Glyph-Mode header tells
+            the mode (RGBA or P) and X-Glyph-Sizes lists the <width>x<height>
+            of each picture.
+        json
+            {"height": ..., "glyphs": [{"char": ..., "codepoint": ...,
+            "width": ..., "height": ..., "png": <base64>}...]}
+    GET /stats
+        Return JSON of cache hit rates and request latencies.
+
+    Arguments
+    ---------
+    font, size
+        The default font and height.
+    fore, outline, back (ImageColor)
+        The default colors.
+    max_fonts, max_glyphs (int)
+        The numbers of loaded fonts and rendered pictures to keep.
+    """
+    def __init__(self, font, size, fore, outline, back, max_fonts=16,
+                 max_glyphs=4096):
+        self.font, self.size = font, size
+        self.colors = {'fore': fore, 'outline': outline, 'back': back}
+        self.fonts = FontPool(max_fonts)
+        self.glyphs = server.LRUCache(max_glyphs)
+        self.latency = server.Latency()
+        self.start = time.time()
+        self.errors = 0
+
+    def handle(self, path, params):
+        if path == '/stats':
+            return 200, 'application/json', self.stats(), {}
+        if path != '/glyph':
+            return 404, 'text/plain', b'Not Found', {}
+
+        start = time.time()
+        try:
+            return self.glyph(params)
+        except (IOError, ValueError) as err:
+            self.errors += 1
+            return (400, 'text/plain; charset=utf-8',
+                    u'{}'.format(err).encode('utf-8'), {})
+        except Exception as err:
+            self.errors += 1
+            return (500, 'text/plain; charset=utf-8',
+                    u'{}: {}'.format(type(err).__name__, err).encode('utf-8'),
+                    {})
+        finally:
+            self.latency.add(time.time() - start)
+
+    def glyph(self, params):
+        chars = list(_iter_chars(params.get('chars', u'')))
+        effect = params.get('effect', 'fore')
+        fmt = params.get('format', 'png')
+        if not chars:
+            raise ValueError('No characters are given.')
+        if effect not in EFFECTS:
+            raise ValueError(u'Unknown effect: {}'.format(effect))
+        if fmt not in ('png', 'raw', 'json'):
+            raise ValueError(u'Unknown format: {}'.format(fmt))
+        if fmt == 'png' and len(chars) != 1:
+            raise ValueError('The png format takes one character; use the '
+                             'raw or json format for several.')
+        colors = tuple(ImageColor.getrgb(params[x]) if x in params
+                       else self.colors[x]
+                       for x in ('fore', 'outline', 'back'))
+        fixed = params.get('fixed', '0').lower() in ('1', 'true', 'yes')
+        size = int(params.get('size', self.size))
+        if not MIN_FONT_SIZE <= size <= MAX_FONT_SIZE:
+            raise ValueError('The size must be from {} to {}.'.format(
+                             MIN_FONT_SIZE, MAX_FONT_SIZE))
+        bits = int(params['bits']) if params.get('bits') else None
+        if bits not in (None, 1, 2, 4, 8):
+            raise ValueError('The bits must be 1, 2, 4, or 8.')
+        if bits == 1 and effect != 'fore':
+            raise ValueError('Decorated pictures of 3 colors cannot be saved '
+                             'in 1 bit.')
+
+        h, font_fn, font_size = self.fonts.resolve(
+            params.get('font', self.font), size)
+        key = (font_fn, font_size, effect, colors, fixed, bits)
+        pics = [self.glyphs.get(key + (ch,)) for ch in chars]
+        missing = sorted(set(ch for ch, x in zip(chars, pics) if x is None))
+        if missing:
+            font = self.fonts.load(font_fn, font_size)
+            rendered = render_multi_pics(missing, font,
+                                         [(effect,) + colors], fixed,
+                                         bits=bits)
+            new = {}
+            for ch, ims in zip(missing, rendered):
+                new[ch] = [ims[0], None]
+                self.glyphs.put(key + (ch,), new[ch])
+            pics = [x or new[ch] for ch, x in zip(chars, pics)]
+
+        headers = {'X-Font-Height': str(h)}
+        if fmt == 'raw':
+            headers['X-Glyph-Mode'] = pics[0][0].mode
+            headers['X-Glyph-Sizes'] = ' '.join('{}x{}'.format(*x[0].size)
+                                                for x in pics)
+            body = b''.join(x[0].tobytes() if x[0].size[0] else b''
+                            for x in pics)
+            return 200, 'application/octet-stream', body, headers
+
+        for pic in pics:
+            if pic[1] is None:
+                pic[1] = encode_pic(pic[0], bits)
+        if fmt == 'png':
+            return 200, 'image/png', pics[0][1], headers
+        glyphs = [{'char': ch, 'codepoint': fontcover.codepoint(ch),
+                   'width': im.size[0], 'height': im.size[1],
+                   'png': base64.b64encode(png)}
+                  for ch, (im, png) in zip(chars, pics)]
+        body = json.dumps({'height': h, 'glyphs': glyphs}, sort_keys=True)
+        return 200, 'application/json', body.encode('utf-8'), headers
+
+    def stats(self):
+        lookups = self.fonts.hits + self.fonts.misses
+        counters = {
+            'uptime_seconds': round(time.time() - self.start, 3),
+            'errors': self.errors,
+            'latency': self.latency.counters(),
+            'glyphs': self.glyphs.counters(),
+            'fonts': {
+                'items': len(self.fonts.fonts),
+                'max_items': self.fonts.max_fonts,
+                'hits': self.fonts.hits,
+                'misses': self.fonts.misses,
+                'hit_rate': round(float(self.fonts.hits) / lookups, 4)
+                            if lookups else None,
+            },
+        }
+        return json.dumps(counters, indent=1, sort_keys=True,
+                          separators=(',', ': ')).encode('utf-8')
 
 #------------------------------------------------------------------------------
 # Command Line Interface
 #------------------------------------------------------------------------------
 
 def parse_args(args):
+    run_args(make_parser().parse_args(args))
+
+
+def run_args(args):
+    """Run the command of parsed arguments, with its --stats, --profile,
+    and --archive - options handled. Return the report of the --stats
+    option (see stats.report), or else None.
+    """
+    report = None
+    streaming = getattr(args, 'archive', None) == '-'
+    if streaming:
+        # keep the standard output for the archive stream; after an error,
+        # it stays redirected for main() to print the error to stderr
+        args.stdout, sys.stdout = sys.stdout, sys.stderr
+    if args.stats:
+        stats.enable()
+    try:
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(args.func, args)
+            finally:
+                profiler.dump_stats(args.profile)
+        else:
+            args.func(args)
+    finally:
+        if args.stats:
+            report = stats.report()
+            stats.disable()
+            for line in stats.format_report(report):
+                print line
+            stats.save_report(args.stats, report)
+    if streaming:
+        sys.stdout = args.stdout
+    return report
+
+
+def make_parser():
+    """Return the parser of the command line; it is made once per process.
+    """
+    global _parser
+    if _parser is None:
+        _parser = _make_parser()
+    return _parser
+
+_parser = None
+
+
+def _make_parser():
     def check_dir(name):
         """Check if the given directory is existing.
         """
@@ -309,37 +1823,567 @@ def parse_args(args):
     def rgb(color):
         return ImageColor.getrgb(color)
 
+    def page_size(text):
+        """Parse a <width>x<height> page size.
+        """
+        try:
+            w, h = [int(x) for x in text.lower().split('x')]
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'invalid page size: {!r}'.format(text))
+        return w, h
+
+    def font_sizes(text):
+        """Parse a list of sizes and ranges of sizes, e.g., 12,16,20..24.
+        """
+        sizes = []
+        try:
+            for word in text.split(','):
+                first, _, last = word.partition('..')
+                sizes += range(int(first), int(last or first) + 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'invalid size list: {!r}'.format(text))
+        if not sizes or not all(MIN_FONT_SIZE <= x <= MAX_FONT_SIZE
+                                for x in sizes):
+            raise argparse.ArgumentTypeError(
+                'invalid size list: {!r} (choose sizes from {} to {})'.format(
+                text, MIN_FONT_SIZE, MAX_FONT_SIZE))
+        return list(OrderedDict.fromkeys(sizes))
+
+    def at_least_zero(text):
+        """Parse a number not less than 0.
+        """
+        try:
+            n = int(text)
+        except ValueError:
+            n = -1
+        if n < 0:
+            raise argparse.ArgumentTypeError(
+                'invalid number: {!r} (choose 0 or more)'.format(text))
+        return n
+
+    def shard_spec(text):
+        """Parse an <i>/<n> shard.
+        """
+        try:
+            i, n = [int(x) for x in text.split('/')]
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'invalid shard: {!r}'.format(text))
+        if not 0 <= i < n:
+            raise argparse.ArgumentTypeError(
+                'invalid shard: {!r} (choose <i> from 0 to <n>-1)'.format(
+                text))
+        return i, n
+
+    def char_list(fn):
+        return ListFile(fn, iter_char_list)
+
+    def filename_list(fn):
+        return ListFile(fn, _iter_list_lines)
+
     def do_name(args):
-        fns = ['%s.png' % x for x in filename_from_chars(args.chars)]
+        fns = ('%s.png' % filename_from_char(x) for x in args.chars)
         save_utf8_file(args.outfile, fns)
 
+    def effect(spec):
+        """Parse an <effect>=<directory>[,<fore>[,<outline>[,<back>]]] spec.
+        """
+        name, _, rest = spec.partition('=')
+        if name not in EFFECTS:
+            raise argparse.ArgumentTypeError(
+                'invalid effect: {!r} (choose from {})'.format(
+                name, ', '.join(EFFECTS)))
+        fields = rest.split(',')
+        colors = [rgb(x) if x else None for x in fields[1:]]
+        if len(colors) > 3:
+            raise argparse.ArgumentTypeError(
+                'too many colors in effect: {!r}'.format(spec))
+        colors += [None] * (3 - len(colors))
+        return [name, fields[0] or name] + colors
+
+    def filenames(args):
+        """Return the filenames of pictures from the -n option, or else
+        derive them from the characters lazily like the name command.
+        """
+        if args.filenames is not None:
+            return args.filenames
+        return ('%s.png' % filename_from_char(x) for x in args.chars)
+
+    def out_files(dir_name, args):
+        return (u'{}/{}'.format(dir_name, fn) for fn in filenames(args))
+
+    def make_renderer(args, effects, size):
+        return Renderer([args.font] + args.fallbacks, size, effects,
+                        args.fixed, args.engine, args.bits, args.jobs,
+                        _font_pool, args.tight)
+
+    def report_uncovered(renderer, chars, max_chars=8):
+        """Report characters no font of a fallback chain covers before
+        drawing them.
+        """
+        missing = renderer.uncovered(chars)
+        if missing:
+            cps = ['U+{:04X}'.format(fontcover.codepoint(x)) for x in missing]
+            more = ' ...' if len(cps) > max_chars else ''
+            print '[INF] {} characters are covered by no font: {}{}'.format(
+                  len(cps), ' '.join(cps[:max_chars]), more)
+
+    def save_pics(renderer, chars, fns):
+        errors = renderer.save(chars, fns)
+        for fn, msg in errors:
+            if isinstance(fn, tuple):
+                fn = u', '.join(fn)
+            print >> sys.stderr, u'[ERR] {}: {}'.format(fn, msg)
+        if errors:
+            raise ValueError('{} pictures failed to generate'.format(
+                             len(errors)))
+
+    def gen_packed(args, renderer, dirs):
+        """Render all pictures in memory and pack them into atlas pages
+        and/or an exported font per directory.
+        """
+        if args.incremental:
+            raise ValueError('The --incremental option does not support '
+                             'the --atlas and --export options.')
+        chars = list(args.chars)
+        rendered = list(renderer.render(chars))
+        pics = [ims for _ch, ims, _metrics in rendered]
+        if dedup.enabled():
+            for ch, ims in zip(chars, pics):
+                dedup.add(dedup.digest(ims), ch)
+        for i, dir_name in enumerate(dirs):
+            ims = [x[i] for x in pics]
+            if args.shard:
+                # the merge packs the pictures of every shard
+                shard.save_pics(dir_name, [_pic_state(x) for x in ims])
+            else:
+                with stats.timing('pack', len(ims)):
+                    save_packed(args, renderer.effects[i], dir_name, chars,
+                                ims)
+            if renderer.tight:
+                save_metrics(dir_name, renderer,
+                             [(ch, m, None) for ch, _ims, m in rendered])
+
+    def gen_tight(args, renderer, dirs):
+        """Render pictures cropped to their ink, save them, and save a
+        metrics table per directory.
+        """
+        if args.incremental:
+            raise ValueError('The --incremental option does not support '
+                             'the --tight option.')
+        fns = izip(*[out_files(x, args) for x in dirs])
+        rows, aliases = [], []
+        with writer.writing():
+            for (ch, ims, metrics), names in izip(
+                    renderer.render(args.chars), fns):
+                rows.append((ch, metrics, names))
+                first = None
+                if dedup.enabled():
+                    first = dedup.add(dedup.digest(ims), ch, names)
+                if first is not None:
+                    aliases.append((names, first))
+                    continue
+                for im, fn in zip(ims, names):
+                    _save_pic(im, fn, args.bits)
+        for names, first in aliases:
+            for src, dst in zip(first, names):
+                dedup.link(src, dst)
+        for i, dir_name in enumerate(dirs):
+            save_metrics(dir_name, renderer,
+                         [(ch, m, names[i]) for ch, m, names in rows])
+
+    def save_metrics(dir_name, renderer, rows):
+        """Save the metrics table of (char, metrics, filename) rows of a
+        directory as JSON.
+        """
+        save_metrics_table(dir_name, renderer.font_metrics(),
+                           metrics_glyphs(rows))
+
+    def metrics_glyphs(rows):
+        glyphs = []
+        for ch, metrics, fn in rows:
+            glyph = dict((k, metrics[k]) for k in METRICS_KEYS)
+            glyph.update(char=ch, codepoint=fontcover.codepoint(ch))
+            if fn is not None:
+                glyph['filename'] = os.path.basename(fn)
+            glyphs.append(glyph)
+        return glyphs
+
+    def save_metrics_table(dir_name, font, glyphs):
+        fn = os.path.join(dir_name, METRICS_NAME)
+        with open(fn, 'wb') as f:
+            f.write(metrics_table(font, glyphs))
+        stats.count_files([fn])
+
+    def metrics_table(font, glyphs):
+        """Return the JSON bytes of a metrics table.
+        """
+        table = {'font': font, 'glyphs': glyphs}
+        return json.dumps(table, indent=1, sort_keys=True,
+                          separators=(',', ': ')).encode('utf-8')
+
+    def save_packed(args, effect, dir_name, chars, ims):
+        fns = []
+        if args.atlas:
+            pages, _places = atlas.save_atlas(dir_name, args.atlas, chars,
+                                              ims, args.page_size,
+                                              bits=args.bits,
+                                              dedup=dedup.enabled(),
+                                              png_options=writer.png_options())
+            fns += [atlas.page_filename(args.atlas, k)
+                    for k in range(len(pages))]
+            fns += [args.atlas + '.json', args.atlas + '.h']
+        if args.export:
+            bpp = args.bits or (4 if effect[0] == 'fore' else 2)
+            formats = ['bin', 'c'] if args.export_format == 'both' \
+                      else [args.export_format]
+            export.save_export(dir_name, args.export, chars, ims,
+                               bpp, args.rle, formats, dedup.enabled())
+            fns += [args.export + ext for fmt, ext in
+                    [('bin', '.bin'), ('c', '.c'), ('c', '.h')]
+                    if fmt in formats]
+        stats.count_files(os.path.join(dir_name, x) for x in fns)
+
+    def gen_incremental(args, renderer, dirs):
+        effects, chain = renderer.effects, renderer.chain
+        fonts = [(_font_key(fn), size) for fn, size in renderer.fonts]
+        fixed = args.fixed
+        if len(fonts) > 1 and fixed:
+            fixed = chain.height    # the height depends on every font
+        manifests = [manifest.Manifest(x) for x in dirs]
+        chars = list(args.chars)
+        names = list(islice(filenames(args), len(chars)))
+        keys = []
+        for ch in chars:
+            font_id, font_size = fonts[chain.index_of(ch)]
+            keys.append([manifest.glyph_key(__version__, ch, font_id,
+                                            font_size, list(eff), fixed,
+                                            args.bits) for eff in effects])
+
+        # group stale characters by the effects to regenerate
+        groups = {}
+        for i, name in enumerate(names):
+            stale = tuple(k for k, m in enumerate(manifests)
+                          if not m.is_fresh(name, keys[i][k]))
+            if stale:
+                groups.setdefault(stale, []).append(i)
+
+        for m in manifests:
+            removed = m.prune(names)
+            if removed:
+                print '[INF] Removed {} pictures from {}'.format(
+                      len(removed), m.dir_name)
+        try:
+            for stale, idx in sorted(groups.items()):
+                for k in stale:
+                    for i in idx:
+                        manifests[k].forget(names[i])
+                fns = [tuple(manifests[k].path(names[i]) for k in stale)
+                       for i in idx]
+                save_pics(make_renderer(args, [effects[k] for k in stale],
+                                        renderer.size),
+                          [chars[i] for i in idx], fns)
+                for k in stale:
+                    for i in idx:
+                        manifests[k].record(names[i], chars[i], keys[i][k])
+        finally:
+            for m in manifests:
+                m.save()
+
+    @contextmanager
+    def deduplicating(args):
+        """Enable the deduplication of drawings in a block if the -D or -R
+        option is given, and then report the collapsed characters.
+        """
+        if not (args.dedup or args.dedup_report):
+            yield
+            return
+        if args.incremental:
+            raise ValueError('The --incremental option does not support '
+                             'the --dedup option.')
+        dedup.enable()
+        try:
+            yield
+        finally:
+            report = dedup.report()
+            dedup.disable()
+            for line in dedup.format_report(report):
+                print line
+            if args.dedup_report:
+                dedup.save_report(args.dedup_report, report)
+
+    def gen_effects(args, effects, dirs):
+        """Generate pictures of effects into their directories, or into
+        a subdirectory per size of several sizes.
+        """
+        if args.shard:
+            select_shard(args)
+        sink = None
+        if args.archive:
+            for used, option in [(args.atlas, '--atlas'),
+                                 (args.export, '--export'),
+                                 (args.incremental, '--incremental'),
+                                 (args.shard, '--shard')]:
+                if used:
+                    raise ValueError('The --archive option does not support '
+                                     'the {} option.'.format(option))
+            sink = archive.Archive(args.archive, args.archive_compression,
+                                   getattr(args, 'stdout', None),
+                                   links=bool(args.dedup or args.dedup_report))
+        sizes = args.sizes
+        if len(sizes) > 1:
+            # read the lists once, and resolve all sizes together
+            args.chars = list(args.chars)
+            args.filenames = list(islice(filenames(args), len(args.chars)))
+            for fn in [args.font] + args.fallbacks:
+                _font_pool.resolve_all(fn, sizes)
+        writer.configure(args.writers, args.compress_level, args.optimize)
+        try:
+            for i, size in enumerate(sizes):
+                renderer = make_renderer(args, effects, size)
+                if i == 0 and args.fallbacks:
+                    report_uncovered(renderer, args.chars)
+                if len(sizes) > 1:
+                    size_dirs = [os.path.join(x, str(size)) for x in dirs]
+                else:
+                    size_dirs = dirs
+                if sink is None:
+                    size_dirs = [check_dir(x) for x in size_dirs]
+                with deduplicating(args):
+                    if sink is not None:
+                        gen_archive(args, renderer, size_dirs, sink)
+                    else:
+                        gen_size(args, renderer, size_dirs)
+                if args.shard:
+                    save_shard_records(args, renderer, size_dirs)
+        except BaseException:
+            if sink is not None:
+                sink.abort()
+            raise
+        if sink is not None:
+            sink.close()
+
+    def gen_size(args, renderer, dirs):
+        if args.atlas or args.export:
+            gen_packed(args, renderer, dirs)
+        elif args.tight:
+            gen_tight(args, renderer, dirs)
+        elif args.incremental:
+            gen_incremental(args, renderer, dirs)
+        else:
+            fns = izip(*[out_files(x, args) for x in dirs])
+            save_pics(renderer, args.chars, fns)
+
+    def gen_archive(args, renderer, dirs, sink):
+        """Render pictures and stream them into an archive, named by their
+        paths in the directories, with the metrics tables of a tight
+        renderer. The pictures of a duplicate drawing are links to the
+        pictures of the first character of the drawing.
+        """
+        fns = izip(*[out_files(x, args) for x in dirs])
+        rows = []
+        for (ch, ims, metrics), names in izip(renderer.render(args.chars),
+                                              fns):
+            if renderer.tight:
+                rows.append((ch, metrics, names))
+            first = None
+            if dedup.enabled():
+                first = dedup.add(dedup.digest(ims), ch, names)
+            if first is not None:
+                for src, dst in zip(first, names):
+                    sink.link(dst, src)
+                continue
+            for im, name in zip(ims, names):
+                with stats.timing('save'):
+                    data = encode_pic(im, args.bits)
+                    sink.add(name, data)
+                stats.count('pictures')
+                stats.count('bytes', len(data))
+        if renderer.tight:
+            font = renderer.font_metrics()
+            for i, dir_name in enumerate(dirs):
+                glyphs = metrics_glyphs([(ch, m, names[i])
+                                         for ch, m, names in rows])
+                sink.add(os.path.join(dir_name, METRICS_NAME),
+                         metrics_table(font, glyphs))
+
+    def select_shard(args):
+        """Keep the characters (and their filenames) of the shard of the
+        --shard option, and list their (index, char, filename) in
+        args.glyphs.
+        """
+        chars = list(args.chars)
+        names = list(islice(filenames(args), len(chars)))
+        args.glyphs = shard.select(chars, names, *args.shard)
+        args.chars = [ch for _i, ch, _fn in args.glyphs]
+        args.filenames = [fn for _i, _ch, fn in args.glyphs]
+
+    def save_shard_records(args, renderer, dirs):
+        """Save the shard record of each directory with a key of the fonts
+        and options; the merge checks the keys of the shards are the same.
+        """
+        fonts = [(_font_key(fn), size) for fn, size in renderer.fonts]
+        for effect, dir_name in zip(renderer.effects, dirs):
+            options = {
+                'effect': effect[0],
+                'atlas': args.atlas,
+                'page_size': list(args.page_size),
+                'export': args.export,
+                'export_format': args.export_format,
+                'rle': args.rle,
+                'bits': args.bits,
+                'dedup': bool(args.dedup or args.dedup_report),
+            }
+            key = manifest.glyph_key(__version__, fonts, list(effect),
+                                     args.fixed, args.tight, options)
+            shard.save_record(dir_name, args.shard[0], args.shard[1], key,
+                              args.glyphs, options)
+
+    def do_merge(args):
+        chars = list(args.chars)
+        groups = OrderedDict()  # relative directory -> shard directories
+        for root in args.shards:
+            for rel in shard.find_records(root):
+                groups.setdefault(rel, []).append(os.path.join(root, rel))
+        if not groups:
+            raise ValueError('No shard records are found in {}'.format(
+                             ', '.join(args.shards)))
+        # check every directory before making any output directory
+        merges = []
+        for rel, dir_names in groups.items():
+            records = [shard.load_record(x) for x in dir_names]
+            places = shard.check(records, chars)
+            merges.append((rel, dir_names, records, places))
+        for rel, dir_names, records, places in merges:
+            out_dir = check_dir(os.path.normpath(os.path.join(args.dir, rel)))
+            merge_shards(chars, dir_names, records, places, out_dir)
+
+    def merge_shards(chars, dir_names, records, places, out_dir):
+        """Merge the output directories of the shards of a directory into
+        the output directory of the whole build; the *records* of the shards
+        are checked to give the *places* of characters (see shard.check).
+        """
+        options = records[0]['options']
+        if options['atlas'] or options['export']:
+            pics = [shard.load_pics(x) for x in dir_names]
+            for dir_name, record, states in zip(dir_names, records, pics):
+                if len(states) != len(record['glyphs']):
+                    raise ValueError('{}: the pictures do not match the shard '
+                                     'record'.format(dir_name))
+            ims = [_pic_from_state(pics[k][j]) for k, j in places]
+            packing = argparse.Namespace(**options)
+            packing.page_size = tuple(options['page_size'])
+            if options['dedup']:
+                dedup.enable()
+            try:
+                with stats.timing('pack', len(ims)):
+                    save_packed(packing, (options['effect'],), out_dir,
+                                chars, ims)
+            finally:
+                dedup.disable()
+        else:
+            for k, j in places:
+                fn = records[k]['glyphs'][j][2]
+                shutil.copyfile(os.path.join(dir_names[k], fn),
+                                os.path.join(out_dir, fn))
+
+        tables = []
+        for dir_name in dir_names:
+            fn = os.path.join(dir_name, METRICS_NAME)
+            if os.path.isfile(fn):
+                with open(fn, 'rb') as f:
+                    tables.append(json.loads(f.read().decode('utf-8')))
+        if tables:
+            save_metrics_table(out_dir, tables[0]['font'],
+                               [tables[k]['glyphs'][j] for k, j in places])
+
+        names = [os.path.join(x, manifest.MANIFEST_NAME) for x in dir_names]
+        if any(os.path.isfile(x) for x in names):
+            merged = manifest.Manifest(out_dir)
+            merged.entries = {}
+            for dir_name in dir_names:
+                merged.entries.update(manifest.Manifest(dir_name).entries)
+            merged.save()
+        print '[INF] Merged {} characters of {} shards into {}'.format(
+              len(chars), len(records), out_dir)
+
+    def gen_effect(args, effect):
+        effects = [(effect, args.fore, getattr(args, 'outline', None),
+                    getattr(args, 'back', None))]
+        gen_effects(args, effects, [args.dir])
+
     def do_fore(args):
-        fns = ['{}/{}'.format(args.dir, fn) for fn in args.filenames]
-        _h, font = select_font(args.font, args.size)
-        gen_fore_pics(args.chars, fns, font, args.fore, args.fixed)
+        gen_effect(args, 'fore')
 
     def do_outline(args):
-        fns = ['{}/{}'.format(args.dir, fn) for fn in args.filenames]
-        _h, font = select_font(args.font, args.size)
-        gen_outline_pics(args.chars, fns, font,
-                      args.fore, args.outline, args.back, args.fixed)
+        gen_effect(args, 'outline')
 
     def do_shadow11(args):
-        fns = ['{}/{}'.format(args.dir, fn) for fn in args.filenames]
-        _h, font = select_font(args.font, args.size)
-        gen_shadow11_pics(args.chars, fns, font,
-                          args.fore, args.outline, args.back, args.fixed)
+        gen_effect(args, 'shadow11')
 
     def do_shadow21(args):
-        fns = ['{}/{}'.format(args.dir, fn) for fn in args.filenames]
-        _h, font = select_font(args.font, args.size)
-        gen_shadow21_pics(args.chars, fns, font,
-                          args.fore, args.outline, args.back, args.fixed)
+        gen_effect(args, 'shadow21')
+
+    def do_all(args):
+        if not args.effects:
+            args.effects = [[x, x, None, None, None] for x in EFFECTS]
+        effects, dirs = [], []
+        for name, dir_name, fg, ol, bg in args.effects:
+            effects.append((name, fg or args.fore, ol or args.outline,
+                            bg or args.back))
+            dirs.append(dir_name if args.archive else check_dir(dir_name))
+        gen_effects(args, effects, dirs)
+
+    def do_serve(args):
+        service = GlyphService(args.font, args.size, args.fore, args.outline,
+                               args.back, args.max_fonts, args.max_glyphs)
+        server.serve(service, args.port, args.socket)
+
+    def do_batch(args):
+        argvs = [job_argv(x) for x in load_job_file(args.jobfile)]
+        for i, argv in enumerate(argvs):
+            try:
+                make_parser().parse_args(argv)
+            except SystemExit:
+                raise ValueError(u'Job {} has invalid arguments: {}'.format(
+                                 i, u' '.join(argv)))
+
+        start = time.time()
+        summaries = run_jobs(argvs, args.jobs)
+        seconds = round(time.time() - start, 3)
+
+        failed = [x for x in summaries if x['error']]
+        for x in summaries:
+            if x['error']:
+                print >> sys.stderr, u'[ERR] Job {}: {}'.format(x['job'],
+                                                                x['error'])
+            else:
+                print (u'[INF] Job {}: {} glyphs, {} pictures in {:.3f} s '
+                       u'({})'.format(x['job'], x['glyphs'], x['pictures'],
+                                      x['seconds'], u' '.join(x['args'])))
+        glyphs = sum(x['glyphs'] for x in summaries)
+        pictures = sum(x['pictures'] for x in summaries)
+        written = sum(x['bytes'] for x in summaries)
+        print '[INF] {} jobs, {} glyphs, {} pictures in {:.3f} s'.format(
+              len(summaries), glyphs, pictures, seconds)
+        if args.summary:
+            summary = {'jobs': summaries, 'glyphs': glyphs,
+                       'pictures': pictures, 'bytes': written,
+                       'seconds': seconds}
+            with open(args.summary, 'wb') as f:
+                f.write(json.dumps(summary, indent=1, sort_keys=True,
+                                   separators=(',', ': ')).encode('utf-8'))
+        if failed:
+            raise ValueError('{} of {} jobs failed'.format(len(failed),
+                                                          len(summaries)))
 
     #--------------------------------------------------------------------------
 
     # create top-level parser
     parser = argparse.ArgumentParser(description=__doc__)
+    parser.set_defaults(stats=None, profile=None)
     parser.add_argument('-v', '--version', action='version',
                         version='%s v%s by %s' %
                         (__software__, __version__, __author__))
@@ -348,22 +2392,24 @@ def parse_args(args):
     # create the parent parser of src
     src = argparse.ArgumentParser(add_help=False)
     src.add_argument('chars', metavar='char-list-file',
-        type=read_char_list,
-        help='The char list file.')
+        type=char_list,
+        help='''The char list file. A line of the file lists characters,
+            a Unicode block name in brackets (e.g., [CJK Unified
+            Ideographs]), or ranges of characters (e.g., U+4E00..U+9FFF).''')
 
     # create the parent parser of filename-list file
     name = argparse.ArgumentParser(add_help=False)
-    name.set_defaults(name='filename.lst')
+    name.set_defaults(filenames=None)
     name.add_argument('-n', '--name', metavar='<file>',
-        dest='filenames', type=read_filename_list,
-        help='''assign a <file> to get the filename list.
-            The default <file> is "%s".
-            ''' % name.get_default('name'))
+        dest='filenames', type=filename_list,
+        help='''assign a <file> to get the filename list. Without this
+            option, filenames are derived from characters as the name
+            command does.''')
 
     # create the parent parser of output dir
     dir = argparse.ArgumentParser(add_help=False)
     dir.set_defaults(dir='out')
-    dir.add_argument('-d', '--dir', metavar='<directory>', type=check_dir,
+    dir.add_argument('-d', '--dir', metavar='<directory>',
         help='''assign the <directory> to store output files.
             The default directory is "%s".
             ''' % dir.get_default('dir'))
@@ -400,6 +2446,17 @@ def parse_args(args):
             The default font is "%s".
             ''' % font.get_default('font'))
 
+    # create the parent parser of fallback fonts
+    fallback = argparse.ArgumentParser(add_help=False)
+    fallback.set_defaults(fallbacks=[])
+    fallback.add_argument('-F', '--fallback', metavar='<file>',
+        dest='fallbacks', action='append',
+        help='''add a fallback font to draw characters the font does not
+            cover. Each character is drawn with the first font covering it
+            in the order of the -f and -F options, and every font is sized
+            to the same height; characters no font covers are reported
+            before drawing. This option can be repeated.''')
+
     # create the parent parser of size
     size = argparse.ArgumentParser(add_help=False)
     size.set_defaults(size=40)
@@ -409,12 +2466,171 @@ def parse_args(args):
             The default size is "%d".
             ''' % size.get_default('size'))
 
+    # create the parent parser of sizes
+    sizes = argparse.ArgumentParser(add_help=False)
+    sizes.set_defaults(sizes=[40])
+    sizes.add_argument('-s', '--size', metavar='<sizes>', dest='sizes',
+        type=font_sizes,
+        help='''assign a font size, or a list of sizes (e.g., 12,16,24 or
+            8..10) to generate in one run; the pictures of each size of
+            several are put in a subdirectory named after the size of each
+            directory. The default size is "%d".
+            ''' % sizes.get_default('sizes')[0])
+
     # create the parent parser of fixed font height
     fixed = argparse.ArgumentParser(add_help=False)
     fixed.set_defaults(fixed=False)
     fixed.add_argument('-H', '--fixed', action='store_true',
         help='''turn on the switch to use fixed height of the font.''')
 
+    # create the parent parser of tight cropping
+    tight = argparse.ArgumentParser(add_help=False)
+    tight.set_defaults(tight=False)
+    tight.add_argument('-T', '--tight', action='store_true',
+        help='''turn on the switch to crop the pictures of each character
+            to their ink bounding box, and save a metrics table %s of
+            advances, bearings, offsets from the top of the line, and box
+            sizes of characters in each directory to position the
+            pictures.''' % METRICS_NAME)
+
+    # create the parent parser of parallel jobs
+    jobs = argparse.ArgumentParser(add_help=False)
+    jobs.set_defaults(jobs=1)
+    jobs.add_argument('-j', '--jobs', metavar='<number>', type=int,
+        help='''assign the <number> of processes to generate pictures in
+            parallel; 0 denotes the number of CPUs.
+            The default <number> is "%d".
+            ''' % jobs.get_default('jobs'))
+
+    # create the parent parser of incremental build
+    incremental = argparse.ArgumentParser(add_help=False)
+    incremental.set_defaults(incremental=False)
+    incremental.add_argument('-i', '--incremental', action='store_true',
+        help='''turn on the switch to generate only pictures whose inputs
+            changed since the last build, and remove pictures of characters
+            no longer listed. A manifest of pictures is kept in the output
+            directory.''')
+
+    # create the parent parser of sharding
+    shard_ = argparse.ArgumentParser(add_help=False)
+    shard_.set_defaults(shard=None)
+    shard_.add_argument('-k', '--shard', metavar='<i>/<n>', type=shard_spec,
+        help='''generate only the <i>-th (0 to <n>-1) of <n> shards of the
+            characters, e.g., on one of <n> machines; characters are split
+            by a hash of their codepoints. A shard record is kept in each
+            output directory, and pictures of atlas pages and exported fonts
+            are kept unpacked until the shards are merged with the merge
+            command.''')
+
+    # create the parent parser of archive output
+    archive_ = argparse.ArgumentParser(add_help=False)
+    archive_.set_defaults(archive=None, archive_compression=None)
+    archive_.add_argument('-o', '--archive', metavar='<file>',
+        help='''stream pictures into an archive <file> instead of
+            directories: a zip file (.zip) or a tar file (.tar, .tar.gz,
+            .tgz, .tar.bz2, or .tbz2); "-" streams a tar file to the
+            standard output. Pictures are named by their paths in the
+            directories, e.g., out/CH_UPP_A.png. With the -D switch, the
+            pictures of a character drawn the same as an earlier one are
+            hard links of a tar file, or copies in a zip file.''')
+    archive_.add_argument('-Z', '--archive-compression',
+        choices=archive.COMPRESSIONS,
+        help='''assign the compression of the archive: none or deflate for
+            a zip file, and none, gzip, or bzip2 for a tar file. The default
+            follows the extension of the archive; a zip file is deflated.''')
+
+    # create the parent parser of bit depth
+    bits = argparse.ArgumentParser(add_help=False)
+    bits.set_defaults(bits=None)
+    bits.add_argument('-B', '--bits', metavar='<number>', type=int,
+        choices=[1, 2, 4, 8],
+        help='''assign the bit depth (1, 2, 4, or 8) of paletted pictures.
+            The fore command makes paletted pictures without anti-aliasing
+            with this option; decorated pictures need 2 bits at least.''')
+
+    # create the parent parser of decoration engine
+    engine = argparse.ArgumentParser(add_help=False)
+    engine.set_defaults(engine='pil')
+    engine.add_argument('-E', '--engine', choices=['pil', 'numpy'],
+        help='''assign the engine to decorate pictures; the numpy engine
+            decorates pictures in batches and requires NumPy.
+            The default engine is "%s".
+            ''' % engine.get_default('engine'))
+
+    # create the parent parser of atlas output
+    atlas_ = argparse.ArgumentParser(add_help=False)
+    atlas_.set_defaults(atlas=None, page_size=(512, 512))
+    atlas_.add_argument('-a', '--atlas', metavar='<name>',
+        help='''pack pictures into atlas pages named <name>_<n>.png instead
+            of a picture per character; the glyph index is saved as
+            <name>.json and <name>.h.''')
+    atlas_.add_argument('-p', '--page-size', metavar='<width>x<height>',
+        type=page_size,
+        help='''assign the size of an atlas page.
+            The default size is "%dx%d".
+            ''' % atlas_.get_default('page_size'))
+
+    # create the parent parser of embedded font export
+    export_ = argparse.ArgumentParser(add_help=False)
+    export_.set_defaults(export=None, export_format='both', rle=False)
+    export_.add_argument('-x', '--export', metavar='<name>',
+        help='''export pictures as a font for embedded targets instead of a
+            picture per character: a binary blob <name>.bin and/or a C
+            source <name>.c with a header <name>.h. Pixels are packed in
+            the bits of the -B option, or else 4 bits for the fore effect
+            and 2 bits for the other effects.''')
+    export_.add_argument('-X', '--export-format', choices=['bin', 'c', 'both'],
+        help='''assign the format of the exported font.
+            The default format is "%s".
+            ''' % export_.get_default('export_format'))
+    export_.add_argument('-r', '--rle', action='store_true',
+        help='''turn on the switch to compress each exported glyph with a
+            per-row RLE if it gets smaller.''')
+
+    # create the parent parser of picture writing
+    png = argparse.ArgumentParser(add_help=False)
+    png.set_defaults(writers=0, compress_level=None, optimize=False)
+    png.add_argument('-w', '--writers', metavar='<number>',
+        type=at_least_zero,
+        help='''assign the <number> of threads per process to compress and
+            write pictures while the next ones are drawn, e.g., 4 for a
+            network-mounted directory; 0 writes each picture before drawing
+            the next one. The default <number> is "%d".
+            ''' % png.get_default('writers'))
+    png.add_argument('-z', '--compress-level', metavar='<level>', type=int,
+        choices=range(10),
+        help='''assign the zlib compression <level> (0-9) of PNG pictures;
+            a lower level saves faster but makes larger files. The default
+            is the level of PIL, i.e., 6.''')
+    png.add_argument('-O', '--optimize', action='store_true',
+        help='''turn on the switch to make PNG pictures as small as
+            possible; it saves slowest.''')
+
+    # create the parent parser of statistics and profiling
+    stats_ = argparse.ArgumentParser(add_help=False)
+    stats_.add_argument('-S', '--stats', metavar='<file>',
+        help='''turn on the timing of each stage (font selection, drawing,
+            decoration, coloring, saving, and packing); print a summary of
+            total and percentile times, glyphs per second, bytes written,
+            and peak memory, and save it as JSON into a <file>.''')
+    stats_.add_argument('-P', '--profile', metavar='<file>',
+        help='''profile the run (without worker processes) with cProfile
+            and dump the statistics into a <file>.''')
+
+    # create the parent parser of deduplication
+    dedup_ = argparse.ArgumentParser(add_help=False)
+    dedup_.set_defaults(dedup=False, dedup_report=None)
+    dedup_.add_argument('-D', '--dedup', action='store_true',
+        help='''turn on the switch to store identical glyph bitmaps only
+            once: the pictures of a character drawn the same as an earlier
+            one are hard links of the earlier ones, and share the entries of
+            atlas pages and exported fonts. Characters collapsed into shared
+            bitmaps are reported, e.g., the missing-glyph boxes of
+            characters a font does not cover.''')
+    dedup_.add_argument('-R', '--dedup-report', metavar='<file>',
+        help='''turn on the -D switch and save the report of collapsed
+            characters as JSON into a <file>.''')
+
     #--------------------------------------------------------------------------
 
     # create the parser for the "name" command
@@ -428,46 +2644,133 @@ def parse_args(args):
 
     # create the parser for the "fore" command
     sub = subparsers.add_parser('fore',
-        parents=[src, name, dir, font, size, fore, fixed],
+        parents=[src, name, dir, font, fallback, sizes, fore, fixed, tight,
+                 jobs, atlas_, export_, engine, incremental, shard_, bits,
+                 dedup_, png, archive_, stats_],
         help='Generate font pictures of only foreground.')
     sub.set_defaults(func=do_fore)
 
     # create the parser for the "outline" command
     sub = subparsers.add_parser('outline',
-        parents=[src, name, dir, font, size, fore, outline, back, fixed],
+        parents=[src, name, dir, font, fallback, sizes, fore, outline, back,
+                 fixed, tight, jobs, atlas_, export_, engine, incremental,
+                 shard_, bits, dedup_, png, archive_, stats_],
         help='Generate font pictures with 1-pixel outline.')
     sub.set_defaults(func=do_outline)
 
     # create the parser for the "shadow11" command
     sub = subparsers.add_parser('shadow11',
-        parents=[src, name, dir, font, size, fore, outline, back, fixed],
+        parents=[src, name, dir, font, fallback, sizes, fore, outline, back,
+                 fixed, tight, jobs, atlas_, export_, engine, incremental,
+                 shard_, bits, dedup_, png, archive_, stats_],
         help='''Generate font pictures with shadow of 1 pixel on right, 1 pixel
             on bottom''')
     sub.set_defaults(func=do_shadow11)
 
     # create the parser for the "shadow21" command
     sub = subparsers.add_parser('shadow21',
-        parents=[src, name, dir, font, size, fore, outline, back, fixed],
+        parents=[src, name, dir, font, fallback, sizes, fore, outline, back,
+                 fixed, tight, jobs, atlas_, export_, engine, incremental,
+                 shard_, bits, dedup_, png, archive_, stats_],
         help='''Generate font pictures with shadow of 2 pixel on right, 1 pixel
             on bottom.''')
     sub.set_defaults(func=do_shadow21)
 
+    # create the parser for the "all" command
+    sub = subparsers.add_parser('all',
+        parents=[src, name, font, fallback, sizes, fore, outline, back, fixed,
+                 tight, jobs, atlas_, export_, engine, incremental, shard_,
+                 bits, dedup_, png, archive_, stats_],
+        help='''Generate font pictures of several effects at once; each
+            character is drawn only once.''')
+    sub.set_defaults(func=do_all, effects=None)
+    sub.add_argument('-e', '--effect', metavar='<spec>', dest='effects',
+        type=effect, action='append',
+        help='''add an effect with a <spec> of
+            "<effect>=<directory>[,<fore>[,<outline>[,<back>]]]", where
+            <effect> is one of %s. Omitted colors follow the -c, -l, and -b
+            options. This option can be repeated; the default is every
+            effect in a directory named after it.
+            ''' % ', '.join(EFFECTS))
+
+    # create the parser for the "merge" command
+    sub = subparsers.add_parser('merge', parents=[src, dir],
+        help='''Merge the output directories of the shards of a build (see
+            the --shard option) into the output of the whole build, checking
+            that every character of the char list is generated by exactly
+            one shard.''')
+    sub.set_defaults(func=do_merge)
+    sub.add_argument('shards', metavar='shard-dir', nargs='+',
+        help='''The output directory of a shard, or a directory holding the
+            output directories of a shard, e.g., the working directory of
+            the all command; a subdirectory is merged into the same one of
+            the output directory.''')
+
+    # create the parser for the "batch" command
+    sub = subparsers.add_parser('batch',
+        help='''Run builds listed in a job file in one process pool; fonts
+            are loaded once per process.''')
+    sub.set_defaults(func=do_batch, jobs=0, summary=None)
+    sub.add_argument('jobfile', metavar='job-file',
+        help='''The job file in JSON, YAML (.yaml, .yml), or TOML (.toml). It
+            holds a list "jobs" of jobs and an optional mapping "defaults"
+            of options shared by jobs. A job maps "command" to a command,
+            "chars" to a char list file, and long option names to their
+            values, e.g., {"command": "fore", "chars": "char.lst", "size":
+            24, "fixed": true}.''')
+    sub.add_argument('-j', '--jobs', metavar='<number>', type=int,
+        help='''assign the <number> of processes to run jobs in parallel; 0
+            denotes the number of CPUs. A job in a process runs serially.
+            The default <number> is "%d".
+            ''' % sub.get_default('jobs'))
+    sub.add_argument('-o', '--summary', metavar='<file>',
+        help='''assign a <file> to save a JSON summary of the timing and
+            the counts of glyphs drawn, pictures saved, and bytes written of
+            each job.''')
+
+    # create the parser for the "serve" command
+    sub = subparsers.add_parser('serve',
+        parents=[font, size, fore, outline, back],
+        help='''Serve pictures of characters over HTTP on a localhost port
+            or a Unix socket, keeping fonts and pictures in LRU caches.
+            GET /glyph?chars=<text> returns pictures with optional font,
+            size, effect, fore, outline, back, fixed, bits, and format (png,
+            raw, or json) parameters; GET /stats returns cache hit rates
+            and latencies.''')
+    sub.set_defaults(func=do_serve, port=8765, socket=None, max_fonts=16,
+                     max_glyphs=4096)
+    sub.add_argument('-p', '--port', metavar='<number>', type=int,
+        help='''assign the <number> of the localhost port to listen on.
+            The default <number> is "%d".
+            ''' % sub.get_default('port'))
+    sub.add_argument('-u', '--socket', metavar='<file>',
+        help='''listen on a Unix domain socket <file> instead of a port.''')
+    sub.add_argument('-m', '--max-fonts', metavar='<number>', type=int,
+        help='''assign the <number> of loaded fonts to keep.
+            The default <number> is "%d".
+            ''' % sub.get_default('max_fonts'))
+    sub.add_argument('-g', '--max-glyphs', metavar='<number>', type=int,
+        help='''assign the <number> of rendered pictures to keep.
+            The default <number> is "%d".
+            ''' % sub.get_default('max_glyphs'))
+
     #--------------------------------------------------------------------------
 
-    # parse args and execute functions
-    args = parser.parse_args(args)
-    args.func(args)
+    return parser
 
 
 def main():
-    """Start point of this module.
+    """Start point of this module. An error exits with status 1, e.g., a
+    failed check of the merge command or a failed job of the batch command.
     """
     try:
         parse_args(sys.argv[1:])
     except IOError as err:
         print err
+        sys.exit(1)
     except ValueError as err:
         print err
+        sys.exit(1)
 
 
 def test():
@@ -495,6 +2798,8 @@ def test():
 
 
 if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()    # for the PyInstaller executable
     main()
     #parse_args(sys.argv[1:])
     #test()
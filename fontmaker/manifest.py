@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+A manifest records, for each picture in an output directory, a key hashing
+the inputs of the picture (char, font, size, effect, colors, ...) and the
+digest of the picture file. An incremental build generates only those
+pictures whose key changed or whose file is missing or modified, and removes
+pictures of characters no longer listed.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import json
+import hashlib
+
+import cache
+
+
+MANIFEST_NAME = '.manifest.json'
+
+
+def glyph_key(*inputs):
+    """Return a hex digest of the JSON serialization of the given inputs.
+    """
+    text = json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class Manifest(object):
+    """The manifest of an output directory.
+    """
+    def __init__(self, dir_name):
+        self.dir_name = dir_name
+        self.filename = os.path.join(dir_name, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename, 'rb') as f:
+                    self.entries = json.loads(f.read().decode('utf-8'))
+            except ValueError:
+                pass    # rebuild everything from a broken manifest
+
+    def path(self, name):
+        return os.path.join(self.dir_name, name)
+
+    def is_fresh(self, name, key):
+        """Return True if the picture *name* was generated with *key* and its
+        file is unchanged since then.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry['key'] != key:
+            return False
+        fn = self.path(name)
+        return os.path.isfile(fn) and cache.hash_file(fn) == entry['digest']
+
+    def forget(self, name):
+        self.entries.pop(name, None)
+
+    def record(self, name, char, key):
+        """Record a generated picture.
+        """
+        self.entries[name] = {'char': char, 'key': key,
+                              'digest': cache.hash_file(self.path(name))}
+
+    def prune(self, names):
+        """Remove pictures (and their entries) not in *names*; return the
+        list of removed names.
+        """
+        names = set(names)
+        removed = sorted(x for x in self.entries if x not in names)
+        for name in removed:
+            fn = self.path(name)
+            if os.path.isfile(fn):
+                os.remove(fn)
+            del self.entries[name]
+        return removed
+
+    def save(self):
+        data = json.dumps(self.entries, indent=1, sort_keys=True,
+                          separators=(',', ': '))
+        cache.atomic_write(self.filename, data.encode('utf-8'))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+This module is a NumPy engine of the decorations in decor module. The
+decorations work on uint8 arrays of levels shaped (..., height, width), so a
+batch of same-height pictures can be decorated at once with array shifts and
+boolean operations. The output is the same as the PIL engine in decor module.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import numpy as np
+from PIL import Image
+
+
+def _shifted(a, dx, dy, fill):
+    """Return an array of *a* shifted by (dx, dy) on the last two axes; the
+    uncovered area takes the *fill* value.
+    """
+    h, w = a.shape[-2:]
+    out = np.empty_like(a)
+    out[...] = fill
+    dst_y, src_y = slice(max(dy, 0), h + min(dy, 0)), \
+                   slice(max(-dy, 0), h - max(dy, 0))
+    dst_x, src_x = slice(max(dx, 0), w + min(dx, 0)), \
+                   slice(max(-dx, 0), w - max(dx, 0))
+    out[..., dst_y, dst_x] = a[..., src_y, src_x]
+    return out
+
+
+def add_outline(a, fg_level, ol_level, bg_level):
+    """Add outline to an array of levels: every non-foreground pixel next to
+    (including diagonally) a foreground pixel takes the outline level.
+    """
+    assert fg_level != ol_level != bg_level
+
+    fg = a == fg_level
+    near = np.zeros_like(fg)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dx or dy:
+                near |= _shifted(fg, dx, dy, False)
+    return np.where(near & ~fg, np.uint8(ol_level), a).astype(np.uint8)
+
+
+def _add_shadow(a, offsets, fg_level, ol_level, bg_level):
+    """Add shadow of foreground shifted by each (dx, dy) of *offsets*.
+    """
+    assert fg_level != ol_level != bg_level
+
+    fg = a == fg_level
+    shadow = np.zeros_like(fg)
+    for dx, dy in offsets:
+        shadow |= _shifted(fg, dx, dy, False)
+    out = np.empty_like(a)
+    out[...] = bg_level
+    out[shadow] = ol_level
+    out[fg] = fg_level
+    return out
+
+
+def add_shadow11(a, fg_level, ol_level, bg_level):
+    """Add shadow of 1 pixel on right, 1 pixel on bottom
+    """
+    return _add_shadow(a, [(1, 0), (1, 1)], fg_level, ol_level, bg_level)
+
+
+def add_shadow21(a, fg_level, ol_level, bg_level):
+    """Add shadow of 2 pixels on right, 1 pixel on bottom
+    """
+    return _add_shadow(a, [(1, 0), (2, 1)], fg_level, ol_level, bg_level)
+
+
+DECORATORS = {
+    'outline': add_outline,
+    'shadow11': add_shadow11,
+    'shadow21': add_shadow21,
+}
+
+#------------------------------------------------------------------------------
+
+def stack(ims, bg_level):
+    """Stack same-height 'L' images into an array shaped (n, height, max
+    width); narrower images are padded with *bg_level* on the right.
+
+    The padding does not change a decoration since the pixels beyond the
+    width of an image are background to the PIL engine, too.
+    """
+    h = ims[0].size[1]
+    w = max(im.size[0] for im in ims)
+    a = np.empty((len(ims), h, w), np.uint8)
+    a[...] = bg_level
+    for i, im in enumerate(ims):
+        iw, ih = im.size
+        assert ih == h
+        if iw:
+            a[i, :, :iw] = np.asarray(im, np.uint8).reshape(ih, iw)
+    return a
+
+
+def unstack(a, widths):
+    """Split a stacked array into 'L' images of given widths.
+    """
+    return [Image.fromarray(np.ascontiguousarray(a[i, :, :w]), 'L')
+            for i, w in enumerate(widths)]
+
+
+def decorate(ims, add_decor, fg_level, ol_level, bg_level):
+    """Decorate a list of 'L' images with a decoration of this module, e.g.,
+    add_outline. Images are grouped by height and each group is decorated as
+    a batch. Return the decorated images in the order of *ims*.
+    """
+    groups = {}
+    for i, im in enumerate(ims):
+        groups.setdefault(im.size[1], []).append(i)
+
+    out = [None] * len(ims)
+    for h, idx in groups.items():
+        widths = [ims[i].size[0] for i in idx]
+        if h == 0 or max(widths) == 0:
+            for i in idx:
+                out[i] = ims[i].copy()
+            continue
+        a = stack([ims[i] for i in idx], bg_level)
+        a = add_decor(a, fg_level, ol_level, bg_level)
+        for i, im in zip(idx, unstack(a, widths)):
+            out[i] = im
+    return out
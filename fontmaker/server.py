@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the plumbing of a long-running render server: a bounded
+LRU cache with hit counters, a recorder of request latencies, and an HTTP
+server listening on a localhost port or a Unix domain socket. The rendering
+itself is an application object with a handle(path, params) method.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import sys
+import signal
+import socket
+import urlparse
+import SocketServer
+import BaseHTTPServer
+from collections import OrderedDict, deque
+
+from stats import percentile
+
+
+class LRUCache(object):
+    """A mapping keeping at most *max_items* items; the least recently used
+    item is dropped beyond it.
+    """
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        """Return the value of a key, or None if it is not cached.
+        """
+        value = self.items.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def counters(self):
+        lookups = self.hits + self.misses
+        return {
+            'items': len(self.items),
+            'max_items': self.max_items,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(float(self.hits) / lookups, 4) if lookups
+                        else None,
+        }
+
+
+class Latency(object):
+    """Latencies of the last *window* requests.
+    """
+    def __init__(self, window=10000):
+        self.times = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.times.append(seconds)
+        self.count += 1
+
+    def counters(self):
+        xs = sorted(self.times)
+        ms = lambda x: round(x * 1000, 3)
+        return {
+            'requests': self.count,
+            'window': len(xs),
+            'mean_ms': ms(sum(xs) / len(xs)) if xs else None,
+            'p50_ms': ms(percentile(xs, 50)),
+            'p90_ms': ms(percentile(xs, 90)),
+            'p99_ms': ms(percentile(xs, 99)),
+            'max_ms': ms(xs[-1]) if xs else None,
+        }
+
+#------------------------------------------------------------------------------
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Pass GET requests to the app of the server. The app returns a (status,
+    content type, body, headers) tuple from a path and a dict of query
+    parameters of Unicode strings.
+    """
+    server_version = 'FontMaker'
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        params = dict((k.decode('utf-8'), v.decode('utf-8'))
+                      for k, v in urlparse.parse_qsl(url.query))
+        status, content_type, body, headers = self.server.app.handle(
+            url.path, params)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in sorted(headers.items()):
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(SocketServer.UnixStreamServer):
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+def make_server(app, port=None, unix_socket=None):
+    """Return a server of an app listening on a port of localhost, or on a
+    Unix domain socket if *unix_socket* is given. Requests are served one by
+    one, so the app needs no locks.
+    """
+    if unix_socket:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('Unix domain sockets are not supported on this '
+                             'platform.')
+        server = UnixHTTPServer(unix_socket, Handler)
+    else:
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), Handler)
+    server.app = app
+    return server
+
+
+def serve(app, port=None, unix_socket=None):
+    """Serve an app until interrupted or terminated.
+    """
+    server = make_server(app, port, unix_socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if unix_socket:
+        print '[INF] Serving on the Unix socket {}'.format(unix_socket)
+    else:
+        print '[INF] Serving on http://127.0.0.1:{}/'.format(
+              server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
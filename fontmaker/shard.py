@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+This module splits a build into shards, e.g., for several machines, and
+checks the shards to merge. A character belongs to the shard selected by a
+stable hash of its codepoint, so every shard of a char list is disjoint and
+the same on every machine. A shard records, in each output directory, the
+characters it generated with their indexes in the char list and a key of
+the options of the build; the pictures of atlas pages and exported fonts
+are kept unpacked for the merge to pack them.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import os
+import json
+import zlib
+import struct
+
+import cache
+from fontcover import codepoint
+
+
+SHARD_NAME = '.shard.json'
+PICS_NAME = '.shard.pics'       # JSON index of unpacked pictures
+PIXELS_NAME = '.shard.pixels'   # their pixels
+
+
+def shard_of(ch, shards):
+    """Return the index of the shard of a character among *shards* shards.
+    """
+    cp = struct.pack('>I', codepoint(ch))
+    return (zlib.crc32(cp) & 0xFFFFFFFF) % shards
+
+
+def select(chars, names, shard, shards):
+    """Return a list of (index, char, filename) of the characters of a shard.
+    """
+    return [(i, ch, fn) for i, (ch, fn) in enumerate(zip(chars, names))
+            if shard_of(ch, shards) == shard]
+
+
+def save_record(dir_name, shard, shards, key, glyphs, options):
+    """Save the record of a shard in an output directory. The *glyphs* lists
+    (index, char, filename) of the generated characters; the *options* is a
+    dict of the options the merge needs, e.g., of atlas pages.
+    """
+    record = {
+        'shard': shard,
+        'shards': shards,
+        'key': key,
+        'glyphs': [list(x) for x in glyphs],
+        'options': options,
+    }
+    data = json.dumps(record, indent=1, sort_keys=True,
+                      separators=(',', ': '))
+    cache.atomic_write(os.path.join(dir_name, SHARD_NAME),
+                       data.encode('utf-8'))
+
+
+def load_record(dir_name):
+    with open(os.path.join(dir_name, SHARD_NAME), 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def save_pics(dir_name, states):
+    """Save the (mode, size, pixels, palette) states of pictures to pack at
+    the merge: a JSON index of the modes, sizes, and palettes, and a file of
+    the pixels. Unlike a pickle, loading them from another machine runs no
+    code.
+    """
+    index, pixels, offset = [], [], 0
+    for mode, size, data, palette in states:
+        index.append([mode, list(size), offset, len(data), palette])
+        pixels.append(data)
+        offset += len(data)
+    cache.atomic_write(os.path.join(dir_name, PIXELS_NAME), b''.join(pixels))
+    data = json.dumps(index, separators=(',', ':'))
+    cache.atomic_write(os.path.join(dir_name, PICS_NAME), data.encode('utf-8'))
+
+
+def load_pics(dir_name):
+    """Return the states of pictures saved by save_pics(); raise ValueError
+    if the files do not match.
+    """
+    with open(os.path.join(dir_name, PICS_NAME), 'rb') as f:
+        index = json.loads(f.read().decode('utf-8'))
+    with open(os.path.join(dir_name, PIXELS_NAME), 'rb') as f:
+        pixels = f.read()
+    states = []
+    try:
+        for mode, (w, h), offset, length, palette in index:
+            data = pixels[offset:offset+length]
+            if len(data) != length:
+                raise ValueError('truncated pixels')
+            states.append((str(mode), (int(w), int(h)), data, palette))
+    except (TypeError, ValueError) as err:
+        raise ValueError('{}: unreadable shard pictures ({})'.format(
+                         os.path.normpath(dir_name), err))
+    return states
+
+
+def find_records(root):
+    """Return a sorted list of the directories (relative to *root*) holding
+    a shard record.
+    """
+    found = []
+    for dir_name, _dirs, files in os.walk(root):
+        if SHARD_NAME in files:
+            found.append(os.path.relpath(dir_name, root))
+    return sorted(found)
+
+#------------------------------------------------------------------------------
+
+def check(records, chars, max_chars=8):
+    """Check the records of the shards of a directory against a char list:
+    the shards are of the same build, and every character of the list is
+    generated exactly once. Return a list of (record number, position in the
+    record) of the characters of the list in order; raise ValueError
+    otherwise.
+    """
+    def cps(xs):
+        more = ' ...' if len(xs) > max_chars else ''
+        return ' '.join('U+{:04X}'.format(codepoint(x))
+                        for x in xs[:max_chars]) + more
+
+    shards = set(x['shards'] for x in records)
+    if len(shards) != 1:
+        raise ValueError('The shards are split into different numbers of '
+                         'shards: {}'.format(sorted(shards)))
+    n = shards.pop()
+    found = sorted(x['shard'] for x in records)
+    if found != range(n):
+        missing = sorted(set(range(n)) - set(found))
+        raise ValueError('Expected shards 0..{} once each; missing {}, '
+                         'found {}'.format(n - 1, missing, found))
+    if len(set(x['key'] for x in records)) != 1:
+        raise ValueError('The shards were generated with different fonts '
+                         'or options.')
+
+    places = [None] * len(chars)
+    twice, unknown = [], []
+    for k, record in enumerate(records):
+        for j, (i, ch, _fn) in enumerate(record['glyphs']):
+            if not 0 <= i < len(chars) or chars[i] != ch:
+                unknown.append(ch)
+            elif places[i] is not None:
+                twice.append(ch)
+            else:
+                places[i] = (k, j)
+    if unknown:
+        raise ValueError('{} generated characters are not in the char '
+                         'list: {}'.format(len(unknown), cps(unknown)))
+    if twice:
+        raise ValueError('{} characters are generated more than once: '
+                         '{}'.format(len(twice), cps(twice)))
+    missing = [chars[i] for i, x in enumerate(places) if x is None]
+    if missing:
+        raise ValueError('{} characters are generated by no shard: '
+                         '{}'.format(len(missing), cps(missing)))
+    return places
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+This module collects timings of the stages of generating pictures (e.g.,
+font selection, drawing, decoration, coloring, and saving), counts of glyphs
+and bytes written, and reports them with percentiles and peak memory. The
+collection is off until enable() is called, and costs nearly nothing then.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import json
+import functools
+import threading
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+
+class Stats(object):
+    """Timings of stages and counts of a run.
+    """
+    def __init__(self):
+        self.start = timer()
+        self.times = {}     # stage -> list of seconds per item
+        self.counts = {}    # key -> number
+        self.batched = set()    # stages timed over batches of items
+        self.lock = threading.Lock()    # for writer threads (see writer)
+
+    def add(self, stage, seconds, n=1):
+        """Add the time of a stage over *n* items; each item takes the
+        average time of the batch.
+        """
+        with self.lock:
+            self.times.setdefault(stage, []).extend([seconds / n] * n)
+            if n > 1:
+                self.batched.add(stage)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def merge(self, data):
+        """Merge the data() of another Stats, e.g., of a worker process.
+        """
+        times, counts, batched = data
+        for stage, xs in times.items():
+            self.times.setdefault(stage, []).extend(xs)
+        for key, n in counts.items():
+            self.count(key, n)
+        self.batched.update(batched)
+
+    def data(self):
+        return self.times, self.counts, self.batched
+
+
+_stats = None
+
+
+def enable():
+    global _stats
+    _stats = Stats()
+
+
+def disable():
+    global _stats
+    _stats = None
+
+
+def enabled():
+    return _stats is not None
+
+
+def count(key, n=1):
+    if _stats is not None:
+        _stats.count(key, n)
+
+
+def count_files(filenames):
+    """Count the bytes of written files.
+    """
+    if _stats is not None:
+        import os
+        _stats.count('bytes', sum(os.path.getsize(x) for x in filenames))
+
+
+def take():
+    """Return the data collected so far and start over; None if disabled.
+    """
+    global _stats
+    if _stats is None:
+        return None
+    data = _stats.data()
+    _stats = Stats()
+    return data
+
+
+def merge(data):
+    if _stats is not None and data:
+        _stats.merge(data)
+
+
+@contextmanager
+def timing(stage, n=1):
+    """Time a block as a stage over *n* items.
+    """
+    if _stats is None:
+        yield
+        return
+    start = timer()
+    try:
+        yield
+    finally:
+        if _stats is not None:
+            _stats.add(stage, timer() - start, n)
+
+
+def timed(stage):
+    """Decorate a function to time each call as a stage.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _stats is None:
+                return func(*args, **kwargs)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if _stats is not None:
+                    _stats.add(stage, timer() - start)
+        return wrapper
+    return decorate
+
+#------------------------------------------------------------------------------
+
+def peak_memory():
+    """Return the peak resident memory (KiB) of this process and its child
+    processes, or None if it is unknown on the platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(xs, p):
+    """Return the p-th percentile of sorted values with the nearest rank.
+    """
+    if not xs:
+        return 0.0
+    k = max(0, min(len(xs) - 1, int(round(p / 100.0 * len(xs))) - 1))
+    return xs[k]
+
+
+def report():
+    """Return a dict of the collected statistics. The percentiles of a
+    stage timed over batches (batched) are of the batch averages per item,
+    not of the times of single items.
+    """
+    wall = timer() - _stats.start
+    stages = {}
+    for stage, xs in _stats.times.items():
+        xs = sorted(xs)
+        stages[stage] = {
+            'count': len(xs),
+            'total': round(sum(xs), 6),
+            'p50': round(percentile(xs, 50), 6),
+            'p90': round(percentile(xs, 90), 6),
+            'p99': round(percentile(xs, 99), 6),
+            'max': round(xs[-1], 6),
+            'batched': stage in _stats.batched,
+        }
+    glyphs = _stats.counts.get('glyphs', 0)
+    return {
+        'wall_seconds': round(wall, 6),
+        'glyphs': glyphs,
+        'glyphs_per_second': round(glyphs / wall, 3) if wall else None,
+        'pictures': _stats.counts.get('pictures', 0),
+        'bytes_written': _stats.counts.get('bytes', 0),
+        'peak_memory_kib': peak_memory(),
+        'stages': stages,
+    }
+
+
+def format_report(rep):
+    """Return lines of a human-readable summary of a report().
+    """
+    memory = rep['peak_memory_kib']
+    lines = [
+        '[INF] {} glyphs in {:.3f} s ({} glyphs/s); {} pictures, {} bytes '
+        'written; peak memory {}'.format(
+            rep['glyphs'], rep['wall_seconds'], rep['glyphs_per_second'],
+            rep['pictures'], rep['bytes_written'],
+            '{:.1f} MiB'.format(memory / 1024.0) if memory else 'n/a'),
+        '{:<12} {:>8} {:>10} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'count', 'total s', 'share', 'p50 us', 'p90 us',
+            'p99 us', 'max us'),
+    ]
+    # the stages of worker processes may take more time than the wall time
+    total = sum(x['total'] for x in rep['stages'].values()) or 1
+    for stage, x in sorted(rep['stages'].items(),
+                           key=lambda item: -item[1]['total']):
+        if x.get('batched'):
+            stage += '*'
+        lines.append('{:<12} {:>8} {:>10.3f} {:>6.1f}% {:>10.1f} {:>10.1f} '
+                     '{:>10.1f} {:>10.1f}'.format(
+                     stage, x['count'], x['total'], x['total'] * 100 / total,
+                     x['p50'] * 1e6, x['p90'] * 1e6, x['p99'] * 1e6,
+                     x['max'] * 1e6))
+    if any(x.get('batched') for x in rep['stages'].values()):
+        lines.append('* timed over batches; the percentiles are of batch '
+                     'averages per glyph')
+    return lines
+
+
+def save_report(fn, rep):
+    with open(fn, 'wb') as f:
+        f.write(json.dumps(rep, indent=1, sort_keys=True,
+                           separators=(',', ': ')).encode('utf-8'))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+This module saves pictures in a pipeline: a drawing loop puts pictures into a
+bounded queue, and a pool of threads encodes them as PNG and writes the files,
+so drawing overlaps with compression and file writes (zlib and file I/O run
+without the GIL). It also keeps the PNG options trading speed for size.
+
+The writer threads work only in a writing() block; the block waits for every
+picture put in it, and raises the first error of saving.
+"""
+__author__ = "Jiang Yu-Kuan <yukuan.jiang@gmail.com>"
+
+import sys
+import threading
+from Queue import Queue
+from contextlib import contextmanager
+
+
+class Writer(object):
+    """A pool of threads calling save functions from a bounded queue. After a
+    failed call, the remaining calls are dropped.
+    """
+    def __init__(self, threads, queue_size=None):
+        self.queue = Queue(queue_size or threads * 16)
+        self.error = None
+        self.threads = [threading.Thread(target=self._run)
+                        for _ in range(threads)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None:
+                    func, args = task
+                    func(*args)
+            except Exception:
+                if self.error is None:
+                    self.error = sys.exc_info()
+            finally:
+                self.queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+    def put(self, func, *args):
+        """Put a call of func(*args); raise the error of an earlier call.
+        """
+        self._check()
+        self.queue.put((func, args))
+
+    def flush(self):
+        """Wait for the calls put so far; raise the first error of them.
+        """
+        self.queue.join()
+        self._check()
+
+    def close(self, check=True):
+        """Wait for the calls put so far and stop the threads.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        if check:
+            self._check()
+
+
+_options = {'threads': 0, 'compress_level': None, 'optimize': False}
+_writer = None
+
+
+def configure(threads=0, compress_level=None, optimize=False):
+    """Assign the number of writer threads (0 or less to save pictures in the
+    calling thread), and the PNG compress level (0-9; None for the default
+    of PIL) and optimize switch.
+    """
+    _options.update(threads=threads, compress_level=compress_level,
+                    optimize=optimize)
+
+
+def options():
+    """Return the options of configure() as a dict.
+    """
+    return dict(_options)
+
+
+def png_options():
+    """Return the keyword arguments of saving a PNG picture.
+    """
+    kwargs = {}
+    if _options['compress_level'] is not None:
+        kwargs['compress_level'] = _options['compress_level']
+    if _options['optimize']:
+        kwargs['optimize'] = True
+    return kwargs
+
+
+@contextmanager
+def writing():
+    """Save the pictures of save() in the block with writer threads, if any.
+    A nested block joins the outer one.
+    """
+    global _writer
+    if _options['threads'] <= 0 or _writer is not None:
+        yield
+        return
+    writer = _writer = Writer(_options['threads'])
+    try:
+        yield
+    except BaseException:
+        _writer = None
+        writer.close(check=False)
+        raise
+    _writer = None
+    writer.close()
+
+
+def save(func, *args):
+    """Call func(*args) to save a picture, in a writer thread if any.
+    """
+    if _writer is None:
+        func(*args)
+    else:
+        _writer.put(func, *args)
+
+
+def flush():
+    """Wait for the pictures put so far, e.g., to link to their files.
+    """
+    if _writer is not None:
+        _writer.flush()